@@ -0,0 +1,96 @@
+"""Compare SQL GROUP BY top-N against the NumPy analytics engine.
+
+Usage: python -m benchmarks.analytics_crossover [DATABASE_URL]
+
+For each log size, prints the latency of one SQL top-N query, the one-off cost
+of loading the log into a column batch, the latency of a top-N over the cached
+batch, and the number of queries after which the NumPy engine has paid back
+its load cost (the crossover point).
+"""
+import random
+import sys
+import time
+
+from sqlalchemy import create_engine, func, insert
+from sqlalchemy.orm import sessionmaker
+
+from db.database import Base
+from models.logsEntity import Log
+from models.rowEntity import Row
+from tools import analytics
+
+SIZES = [1_000, 10_000, 100_000, 500_000]
+REPEAT = 5
+
+
+def populate(db, n_rows: int) -> Log:
+    log = Log(file_name=f"bench_{n_rows}.log", file_type="apache")
+    db.add(log)
+    db.commit()
+    rng = random.Random(n_rows)
+    batch = []
+    for i in range(n_rows):
+        batch.append({
+            "ip": f"10.{rng.randint(0, 3)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}",
+            "url": f"/items/{rng.randint(0, 500)}",
+            "method": rng.choice(["GET", "GET", "GET", "POST", "HEAD"]),
+            "status": rng.choice([200, 200, 200, 301, 404, 500]),
+            "response_size": rng.randint(0, 50_000),
+            "timestamp": f"10/Oct/2000:13:{(i // 60) % 60:02d}:{i % 60:02d} -0700",
+            "log_id": log.id,
+        })
+        if len(batch) == 10_000:
+            db.execute(insert(Row), batch)
+            batch = []
+    if batch:
+        db.execute(insert(Row), batch)
+    db.commit()
+    return log
+
+
+def best_of(fn) -> float:
+    timings = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def sql_top(db, log):
+    return db.query(Row.url, func.count(Row.url)) \
+        .filter(Row.log_id == log.id) \
+        .group_by(Row.url) \
+        .order_by(func.count(Row.url).desc()) \
+        .limit(5) \
+        .all()
+
+
+def main(url: str):
+    engine = create_engine(url)
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+
+    print(f"{'rows':>10} {'sql top-N':>12} {'numpy load':>12} {'numpy top-N':>12} {'crossover':>10}")
+    for n_rows in SIZES:
+        log = populate(db, n_rows)
+
+        sql = best_of(lambda: sql_top(db, log))
+
+        def cold_load():
+            analytics.cache.invalidate(log.id)
+            analytics.load_batch(db, log)
+
+        load = best_of(cold_load)
+        batch = analytics.load_batch(db, log)
+        vectorized = best_of(lambda: batch.top_n("url", 5))
+
+        saving = sql - vectorized
+        crossover = f"{load / saving:.1f}" if saving > 0 else "never"
+        print(f"{n_rows:>10} {sql * 1000:>10.2f}ms {load * 1000:>10.2f}ms {vectorized * 1000:>10.2f}ms {crossover:>10}")
+
+    db.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1] if len(sys.argv) > 1 else "sqlite:///bench_analytics.db")
@@ -0,0 +1,93 @@
+"""Measure what the user-agent/route enrichment stage adds to ingest.
+
+Usage: python -m benchmarks.enrichment_overhead [DATABASE_URL]
+
+For each size, generates an Apache access log with a realistic pool of user
+agents and id-bearing URLs, then prints the best-of-N time to parse it, to
+enrich the parsed rows, and to bulk insert them, plus the share of the whole
+ingest spent in enrichment and the classifier cache hit rates.
+"""
+import random
+import sys
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks.analytics_crossover import best_of
+from db.database import Base
+from models.logsEntity import Log
+from models.rowEntity import Row
+from tools import enrichment
+from tools.parser import parse_apache_log
+
+SIZES = [10_000, 100_000]
+
+USER_AGENTS = [
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/{v}.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/{v}.0.0.0 Safari/537.36 Edg/{v}.0.0.0",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.{v} Safari/605.1.15",
+    "Mozilla/5.0 (X11; Linux x86_64; rv:{v}.0) Gecko/20100101 Firefox/{v}.0",
+    "Mozilla/5.0 (iPhone; CPU iPhone OS 17_{v} like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 Mobile/15E148 Safari/604.1",
+    "Mozilla/5.0 (Linux; Android 14; SM-S918B) AppleWebKit/537.36 (KHTML, like Gecko) SamsungBrowser/{v}.0 Chrome/115.0.0.0 Mobile Safari/537.36",
+    "Mozilla/5.0 (compatible; Googlebot/2.{v}; +http://www.google.com/bot.html)",
+    "curl/8.{v}.0",
+]
+
+
+def generate(n_rows: int) -> str:
+    rng = random.Random(n_rows)
+    agents = [ua.format(v=v) for ua in USER_AGENTS for v in range(100, 110)]
+    lines = []
+    for i in range(n_rows):
+        url = rng.choice([
+            f"/items/{rng.randint(0, 5000)}",
+            f"/users/{rng.randint(0, 500)}/orders/{rng.randint(0, 100_000)}",
+            f"/static/app.{rng.randint(0, 9)}.js",
+            f"/search?q={rng.randint(0, 1000)}",
+        ])
+        lines.append(
+            f'10.0.{rng.randint(0, 255)}.{rng.randint(0, 255)} - - '
+            f'[10/Oct/2000:13:{(i // 60) % 60:02d}:{i % 60:02d} -0700] "GET {url} HTTP/1.1" '
+            f'{rng.choice([200, 200, 304, 404])} {rng.randint(0, 50_000)} "-" "{rng.choice(agents)}"'
+        )
+    return "\n".join(lines)
+
+
+def main(url: str):
+    engine = create_engine(url)
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    log = Log(file_name="bench_enrichment.log", file_type="apache")
+    db.add(log)
+    db.commit()
+
+    print(f"{'rows':>10} {'parse':>10} {'enrich':>10} {'insert':>10} {'share':>7}")
+    for n_rows in SIZES:
+        contents = generate(n_rows)
+        parse = best_of(lambda: parse_apache_log(contents))
+        rows = parse_apache_log(contents)
+
+        def cold_enrich():
+            enrichment.classify_user_agent.cache_clear()
+            enrichment.url_route.cache_clear()
+            for row in rows:
+                enrichment.enrich(row)
+
+        enrich = best_of(cold_enrich)
+        values = [dict(row.model_dump(exclude_none=True), log_id=log.id) for row in rows]
+
+        def bulk_insert():
+            db.execute(insert(Row), values)
+            db.rollback()
+
+        store = best_of(bulk_insert)
+        share = enrich / (parse + enrich + store)
+        print(f"{n_rows:>10} {parse * 1000:>8.1f}ms {enrich * 1000:>8.1f}ms {store * 1000:>8.1f}ms {share:>6.1%}")
+
+    for name, stats in enrichment.cache_stats().items():
+        print(f"{name} cache: {stats['hits']} hits, {stats['misses']} misses, hit rate {stats['hit_rate']:.2%}")
+    db.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1] if len(sys.argv) > 1 else "sqlite:///bench_enrichment.db")
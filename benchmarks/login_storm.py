@@ -0,0 +1,67 @@
+"""Login-storm load test: latency of a cheap route while many sign-ins hash passwords.
+
+Usage: python -m benchmarks.login_storm [BASE_URL] [CONCURRENT_LOGINS]
+
+Start the API first (uvicorn main:app --workers 1). The script creates a test
+user, measures GET /favicon.ico latency alone, then again while
+CONCURRENT_LOGINS clients repeatedly sign in, and prints p50/p99 for both runs.
+With bcrypt on the event loop the p99 under load grows by the hashing time
+multiplied by the queue depth; with the executor it should stay roughly flat.
+"""
+import asyncio
+import statistics
+import sys
+import time
+import uuid
+
+import httpx
+
+PROBES = 200
+PROBE_INTERVAL = 0.01
+
+
+async def probe(client: httpx.AsyncClient) -> list:
+    latencies = []
+    for _ in range(PROBES):
+        start = time.perf_counter()
+        await client.get("/favicon.ico")
+        latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(PROBE_INTERVAL)
+    return latencies
+
+
+async def storm(client: httpx.AsyncClient, email: str, password: str, stop: asyncio.Event):
+    while not stop.is_set():
+        await client.post("/auth/sign_in", data={"username": email, "password": password})
+
+
+def report(label: str, latencies: list):
+    latencies = sorted(latencies)
+    p50 = statistics.median(latencies) * 1000
+    p99 = latencies[int(len(latencies) * 0.99) - 1] * 1000
+    print(f"{label:>16}: p50 {p50:8.2f}ms  p99 {p99:8.2f}ms")
+
+
+async def main(base_url: str, concurrency: int):
+    email = f"storm-{uuid.uuid4().hex[:8]}@example.com"
+    password = "correct horse battery staple"
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        await client.post("/auth/sign_up", json={
+            "firstName": "Load", "lastName": "Test", "company": "LASys",
+            "password": password, "email": email,
+        })
+
+        report("idle", await probe(client))
+
+        stop = asyncio.Event()
+        workers = [asyncio.create_task(storm(client, email, password, stop)) for _ in range(concurrency)]
+        await asyncio.sleep(1)
+        report(f"{concurrency} logins", await probe(client))
+        stop.set()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+
+if __name__ == "__main__":
+    url = sys.argv[1] if len(sys.argv) > 1 else "http://localhost:8000"
+    logins = int(sys.argv[2]) if len(sys.argv) > 2 else 32
+    asyncio.run(main(url, logins))
@@ -4,7 +4,8 @@ from routers.auth import router as authRouter
 from routers.rowsController import router as rowsRouter
 from routers.logsController import router as logsRouter
 from fastapi.middleware.cors import CORSMiddleware
-from db.database import Base, engine
+from brotli_asgi import BrotliMiddleware
+from db.database import create_tables
 from slowapi import Limiter
 from slowapi.util import get_remote_address
 from slowapi.middleware import SlowAPIMiddleware
@@ -16,7 +17,7 @@ limiter = Limiter(key_func=get_remote_address)
 app = FastAPI()
 
 # Base metadata setup
-Base.metadata.create_all(bind=engine)
+create_tables()
 
 # Add rate limiting middleware
 app.state.limiter = limiter
@@ -26,6 +27,9 @@ app.add_exception_handler(
 )
 app.add_middleware(SlowAPIMiddleware)
 
+# Compress large responses with brotli, falling back to gzip for clients without br support
+app.add_middleware(BrotliMiddleware, minimum_size=1024, gzip_fallback=True)
+
 # Include routers
 app.include_router(rowsRouter, prefix="/api/v1")
 app.include_router(logsRouter, prefix="/api/v1")
@@ -38,6 +42,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Estimated", "X-Sample-Rate"],
 )
 
 @app.get("/")
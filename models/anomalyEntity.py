@@ -0,0 +1,16 @@
+from sqlalchemy import Integer, String, Column, Sequence, ForeignKey
+from sqlalchemy.orm import relationship
+from db.database import Base
+
+class Anomaly(Base):
+    __tablename__ = "anomaly"
+    id = Column(Integer, Sequence("anomaly_id_seq"), primary_key=True, index=True, autoincrement=True)
+    ip = Column(String, index=True)
+    kind = Column(String)            # rate, errors or fanout
+    window_start = Column(String)    # ISO 8601, UTC
+    window_end = Column(String)
+    peak = Column(Integer)           # Highest value seen within one window
+    threshold = Column(Integer)
+
+    log_id = Column(Integer, ForeignKey('log.id'), index=True)
+    owner = relationship("Log", back_populates="anomalies")
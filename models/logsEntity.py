@@ -1,12 +1,35 @@
-from sqlalchemy import Integer, String, Column
-from sqlalchemy.orm import relationship
-from db.database import Base
-
-class Log(Base):
-    __tablename__ = "log"
-    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
-    log_of = Column(String)
-    file_name = Column(String)
-    file_type = Column(String)
-    rows = relationship("Row", back_populates="owner")
+from sqlalchemy import Integer, Double, String, Column, Sequence, JSON, func
+from sqlalchemy.orm import relationship
+from db.database import Base
+from models.anomalyEntity import Anomaly  # noqa: F401  (target of Log.anomalies, registered for every importer of Log)
+
+class Log(Base):
+    __tablename__ = "log"
+    id = Column(Integer, Sequence("log_id_seq"), primary_key=True, index=True, autoincrement=True)
+    log_of = Column(String)
+    file_name = Column(String)
+    file_type = Column(String)
+    archive_path = Column(String, nullable=True)  # Columnar cold-storage directory once archived
+    sketches = Column(JSON, nullable=True)        # Mergeable approximate statistics built at ingest
+    parse_report = Column(JSON, nullable=True)    # Rejection counts and sampled bad lines from the upload parse
+    sample_rate = Column(Double, default=1.0)     # Fraction of the uploaded rows that were stored
+    version = Column(Integer, default=1)          # Ingest version, bumped whenever rows are appended or moved
+    rows = relationship("Row", back_populates="owner")
+    anomalies = relationship("Anomaly", back_populates="owner", cascade="all, delete-orphan")
+
+    def bump_version(self):
+        """Mark the log's rows as changed so ETags and cached column batches derived from the old version go stale.
+
+        The increment is evaluated by the database at flush (UPDATE log SET version = version + 1), so two writers
+        that loaded the same version both count; the attribute is reloaded on next access.
+        """
+        self.version = func.coalesce(Log.version, 0) + 1
+
+    @property
+    def archived(self):
+        return self.archive_path is not None
+
+    @property
+    def sampled(self):
+        return self.sample_rate is not None and self.sample_rate < 1
     
\ No newline at end of file
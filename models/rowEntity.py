@@ -1,10 +1,16 @@
-from sqlalchemy import Integer, String, Column, ForeignKey
+from sqlalchemy import Integer, Double, String, Column, Sequence, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from db.database import Base
 
 class Row(Base):
     __tablename__ = "row"
-    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    # Composite indexes so per-log GROUP BYs and filters never scan other logs
+    __table_args__ = tuple(
+        Index(f"ix_row_log_id_{column}", "log_id", column)
+        for column in ("status", "url", "method", "ip", "protocol", "user", "user_agent",
+                       "browser", "os", "agent_type", "route", "epoch")
+    )
+    id = Column(Integer, Sequence("row_id_seq"), primary_key=True, index=True, autoincrement=True)
     ip = Column(String, index=True)
     url = Column(String)
     timestamp = Column(String)
@@ -27,5 +33,14 @@ class Row(Base):
     request = Column(String, nullable=True)
     pid_tid = Column(String, nullable=True)
 
+    # Derived at ingest from user_agent and url (see tools/enrichment.py)
+    browser = Column(String, nullable=True)
+    os = Column(String, nullable=True)
+    agent_type = Column(String, nullable=True)   # "bot" or "human"
+    route = Column(String, nullable=True)        # URL template, e.g. /items/{id}
+    epoch = Column(Double, nullable=True)        # timestamp as epoch seconds, so time ranges compare numerically
+
+    weight = Column(Double, default=1.0)         # Rows of the full log this row stands for (1 / sample rate)
+
     log_id = Column(Integer, ForeignKey('log.id'))
     owner = relationship("Log", back_populates="rows")
@@ -1,5 +1,5 @@
 from sqlalchemy import Integer, String, Column, ForeignKey, Enum
-from db.database import Base
+from db.database import RelationalBase
 from enum import Enum as PyEnum
 
 
@@ -8,7 +8,7 @@ class RoleEnum(PyEnum):
     admin = "admin"
 
 
-class User(Base):
+class User(RelationalBase):
     __tablename__ = 'users'
 
     id = Column(Integer,primary_key = True, autoincrement = True, index= True)
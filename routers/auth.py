@@ -1,16 +1,22 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta, datetime
 from typing import Annotated
 from passlib.context import CryptContext
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
 from jose import JWTError, jwt
 from pydantic import BaseModel
 from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from starlette import status
 from db.database import get_db
 from models.usersEntity import User
 from random import randint
+from utils.cache import TTLCache
 
 router = APIRouter(
     prefix='/auth',
@@ -23,6 +29,16 @@ ALGORITHM = 'HS256'
 bcrypt_context = CryptContext(schemes=['bcrypt'], deprecated="auto")
 oauth2_bearer = OAuth2PasswordBearer(tokenUrl='auth/token')
 
+# bcrypt runs on a dedicated pool so it never blocks the event loop; at most
+# HASH_WORKERS hashes run at once and HASH_QUEUE more may wait before we shed load
+HASH_WORKERS = int(os.getenv("LASYS_HASH_WORKERS", "2"))
+HASH_QUEUE = int(os.getenv("LASYS_HASH_QUEUE", "64"))
+hash_executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="bcrypt")
+hash_slots = asyncio.Semaphore(HASH_WORKERS + HASH_QUEUE)
+
+# Users looked up by GET /auth/, keyed by the (username, id) carried in the JWT
+principal_cache = TTLCache(ttl=float(os.getenv("LASYS_PRINCIPAL_TTL_SECONDS", "60")))
+
 class CreateUserRequest(BaseModel):
     firstName: str
     lastName: str
@@ -37,31 +53,71 @@ class Token(BaseModel):
 
 db_dependency = Annotated[Session, Depends(get_db)]
 
+async def run_hash(fn, *args):
+    if hash_slots.locked():
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many concurrent authentication requests.",
+            headers={"Retry-After": "1"},
+        )
+    async with hash_slots:
+        return await asyncio.get_running_loop().run_in_executor(hash_executor, fn, *args)
+
+async def hash_password(password: str) -> str:
+    return await run_hash(bcrypt_context.hash, password)
+
+async def verify_password(password: str, hashed_password: str) -> bool:
+    return await run_hash(bcrypt_context.verify, password, hashed_password)
+
 @router.post("/sign_up", status_code=status.HTTP_201_CREATED)
 async def create_user(db: db_dependency, create_user_request: CreateUserRequest):
-    if(validate_user_email(db,create_user_request.email)):
+    if not await run_in_threadpool(validate_user_email, db, create_user_request.email):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, 
+            detail="Email exist."
+        )
+    hashed_password = await hash_password(create_user_request.password)
+    await run_in_threadpool(
+        insert_user, db, create_user_request, hashed_password
+    )
+
+def insert_user(db, create_user_request: CreateUserRequest, hashed_password: str, attempts: int = 3):
+    for _ in range(attempts):
         user = User(
             firstName = create_user_request.firstName,
             lastName = create_user_request.lastName,
             company = create_user_request.company,
             email = create_user_request.email,
             username = generate_unique_username(db, create_user_request.firstName, create_user_request.lastName),
-            hashed_password=bcrypt_context.hash(create_user_request.password)
+            hashed_password=hashed_password
         )
         db.add(user)
-        db.commit()
-    else:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST, 
-            detail="Email exist."
-        )
-def authenticated_user(username: str, password: str, db: db_dependency):
-    user = db.query(User).filter(
+        try:
+            # The unique constraint on username is what actually reserves the name
+            db.commit()
+            return user
+        except IntegrityError:
+            db.rollback()
+            if not validate_user_email(db, create_user_request.email):
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST, 
+                    detail="Email exist."
+                )
+    raise HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail="Could not reserve a unique username, please retry."
+    )
+
+def find_user(db, username: str):
+    return db.query(User).filter(
         or_(User.username == username, User.email == username)
     ).first()
+
+async def authenticated_user(username: str, password: str, db: db_dependency):
+    user = await run_in_threadpool(find_user, db, username)
     if not user:
         return False
-    if not bcrypt_context.verify(password, user.hashed_password):
+    if not await verify_password(password, user.hashed_password):
         return False
     return user
 
@@ -76,7 +132,7 @@ async def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends(),
     db: Session = Depends(get_db)
 ):
-    user = authenticated_user(form_data.username, form_data.password, db)
+    user = await authenticated_user(form_data.username, form_data.password, db)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, 
@@ -109,21 +165,33 @@ async def get_current_user(token: Annotated[str, Depends(oauth2_bearer)]):
 
 @router.get("/", status_code=status.HTTP_200_OK)
 async def user(db: db_dependency, user_data: Annotated[dict, Depends(get_current_user)]):
-    # Fetch user details from the database using the token payload
-    user = db.query(User).filter_by(username=user_data["username"], id=user_data["id"]).first()
-    
-    if user is None:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Authentication failed.")
+    key = (user_data["username"], user_data["id"])
+    principal = principal_cache.get(key)
+    if principal is None:
+        # Fetch user details from the database using the token payload
+        user = await run_in_threadpool(
+            lambda: db.query(User).filter_by(username=user_data["username"], id=user_data["id"]).first()
+        )
+        
+        if user is None:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Authentication failed.")
+        
+        principal = {"id": user.id, "username": user.username, "email": user.email, "role":user.role}
+        principal_cache.set(key, principal)
     
     # Return serialized user data
-    return {"User": {"id": user.id, "username": user.username, "email": user.email, "role":user.role}}
-
-
-def generate_unique_username(db, first_name, last_name):
-    base_username = f"{first_name}.{last_name}_{randint(0, 999)}"
-    while db.query(User).filter(User.username == base_username).first():
-        base_username = f"{first_name}.{last_name}_{randint(0, 999)}"
-    return base_username
+    return {"User": principal}
+
+
+def generate_unique_username(db, first_name, last_name, candidates=20):
+    # Check a batch of random suffixes in one query instead of one query per guess
+    names = list(dict.fromkeys(f"{first_name}.{last_name}_{randint(0, 999)}" for _ in range(candidates)))
+    taken = {name for (name,) in db.query(User.username).filter(User.username.in_(names))}
+    free = [name for name in names if name not in taken]
+    if free:
+        return free[0]
+    # Every short suffix we drew is taken; fall back to a much larger space
+    return f"{first_name}.{last_name}_{randint(1000, 999999)}"
 
 def validate_user_email(db, email):
     return db.query(User).filter(User.email == email).first() is None
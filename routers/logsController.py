@@ -1,15 +1,27 @@
 import subprocess
-from fastapi import APIRouter, Depends, File, HTTPException, UploadFile
+from fastapi import APIRouter, Depends, File, HTTPException, Query, UploadFile
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from sqlalchemy import func
 from sqlalchemy.orm import Session
-from typing import List
-from tools.parser import parse_apache_log
+from typing import List, Literal, Optional
+from tools.parser import FORMATS, SNIFF_BYTES, ParseReport, finish_parse, iter_entries, read_lines, sniff_format, to_row
+from tools.archive import archive_log, drop_archive
+from tools import analytics
+from tools.columnar import ROW_COLUMNS
+from tools.sketches import LogSketches
+from tools.anomalies import RateDetector
+from tools.aggregate import build_aggregate, split_list
+from tools.sampling import SAMPLE_KEYS, Sampler
+from tools.enrichment import enrich
+from utils.conditional import conditional_log
 from models.rowEntity import Row
 from models.logsEntity import Log
-from db.database import get_db
+from models.anomalyEntity import Anomaly
+from db.database import get_db, get_read_db, mark_write
 from schemas.logDTO import LogDTO ,LogCreate
 from schemas.rowDTO import RowDTO
+from schemas.anomalyDTO import AnomalyDTO
 
 import logging
 
@@ -21,9 +33,42 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# "sql" runs a GROUP BY per request, "numpy" scans the log's cached column batch
+QueryEngine = Literal["sql", "numpy"]
+
+# Upload formats that can be forced with ?format= instead of being sniffed
+LogFormatName = Literal[tuple(FORMATS)]
+
+def top_counts(db: Session, log: Log, column, n: int = 5, engine: QueryEngine = "sql"):
+    """Return the n most frequent values of a Row column as (value, count) pairs."""
+    if log.archived or engine == "numpy":
+        return analytics.load_batch(db, log).top_n(column.key, n)
+    if log.sampled:
+        # Each stored row of a sampled log stands for `weight` rows of the original
+        estimate = func.sum(Row.weight)
+        counts = db.query(column, estimate) \
+            .filter(Row.log_id == log.id, column.isnot(None)) \
+            .group_by(column) \
+            .order_by(estimate.desc()) \
+            .limit(n) \
+            .all()
+        return [(value, int(round(count))) for value, count in counts]
+    return db.query(column, func.count(column)) \
+        .filter(Row.log_id == log.id) \
+        .group_by(column) \
+        .order_by(func.count(column).desc()) \
+        .limit(n) \
+        .all()
+
+def log_rows(db: Session, log: Log):
+    """Return the rows of a log, read from cold storage when the log is archived."""
+    if log.archived:
+        return [RowDTO(**row) for row in analytics.load_batch(db, log).rows()]
+    return log.rows
+
 # GET: get all logs
 @router.get("/logs", response_model=List[LogDTO])
-def find_all_logs(db: Session = Depends(get_db)):
+def find_all_logs(db: Session = Depends(get_read_db)):
     try:
         logs = db.query(Log).all()
         if not logs:
@@ -35,17 +80,31 @@ def find_all_logs(db: Session = Depends(get_db)):
         print(e)
         logger.error(f"Error occurred while fetching logs: {e}")
         raise HTTPException(status_code=500, detail=f"An error occurred while fetching logs: {e}")
+
+# GET: get approximate statistics merged across several logs
+@router.get("/logs/approxstats")
+def find_approx_stats_by_log_ids(log_id: List[int] = Query(...), top: int = Query(10, ge=1, le=64), db: Session = Depends(get_read_db)):
+    logs = db.query(Log).filter(Log.id.in_(log_id)).all()
+    missing = set(log_id) - {log.id for log in logs}
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Logs not found: {sorted(missing)}")
+    merged = LogSketches()
+    for log in logs:
+        if not log.sketches:
+            raise HTTPException(status_code=409, detail=f"No approximate statistics stored for log {log.id}")
+        merged.merge(LogSketches.from_dict(log.sketches))
+    return merged.summary(top)
     
 # GET: get a log by ID
-@router.get("/logs/{log_id}",response_model=LogDTO)
-def get_log_by_id(log_id:int,db:Session =Depends(get_db)):
+@router.get("/logs/{log_id}",response_model=LogDTO, dependencies=[Depends(conditional_log)])
+def get_log_by_id(log_id:int,db:Session =Depends(get_read_db)):
     log = db.query(Log).filter(Log.id == log_id).first()
     if log is None:
         raise HTTPException(status_code=404,detail="Log not found")
     return log
 
 # POST: Create a new log
-@router.post("/logs", response_model=LogCreate)
+@router.post("/logs", response_model=LogCreate, dependencies=[Depends(mark_write)])
 def create_log(log: LogCreate, db: Session = Depends(get_db)):
     try:
         db_log = Log(
@@ -66,37 +125,112 @@ def create_log(log: LogCreate, db: Session = Depends(get_db)):
         )
 
 # DELETE: Delete a log by ID
-@router.delete("/logs/{log_id}", response_model=LogDTO)
+@router.delete("/logs/{log_id}", response_model=LogDTO, dependencies=[Depends(mark_write)])
 def delete_log(log_id: int, db: Session = Depends(get_db)):
     db_log = db.query(Log).filter(Log.id == log_id).first()
     
     if db_log is None:
         raise HTTPException(status_code=404, detail="Log not found")
     
+    deleted_log = LogDTO.model_validate(db_log)
+    archive_path = db_log.archive_path
+    # Remove the rows in bulk rather than orphaning them row by row. This is committed
+    # on its own because DuckDB checks foreign keys against the last committed state
+    db.query(Row).filter(Row.log_id == log_id).delete(synchronize_session=False)
+    db.query(Anomaly).filter(Anomaly.log_id == log_id).delete(synchronize_session=False)
+    db.commit()
     db.delete(db_log)
     db.commit()
+    drop_archive(archive_path)
+    analytics.cache.invalidate(log_id)
     
-    return db_log
+    return deleted_log
+
+# POST: Move the rows of a log to columnar cold storage
+@router.post("/logs/{log_id}/archive", dependencies=[Depends(mark_write)])
+def archive_log_by_id(log_id: int, db: Session = Depends(get_db)):
+    log = db.query(Log).filter(Log.id == log_id).first()
+    if log is None:
+        raise HTTPException(status_code=404, detail="Log not found")
+    if log.archived:
+        raise HTTPException(status_code=409, detail="Log is already archived")
+    try:
+        archived_rows = archive_log(db, log)
+        analytics.cache.invalidate(log_id)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error occurred while archiving log {log_id}: {e}")
+        raise HTTPException(status_code=500, detail=f"An error occurred while archiving the log: {e}")
+    return {"message": "Log archived successfully", "log_id": log_id, "rows": archived_rows}
+def read_upload(file, log_format: str, sample_rate: float, sample_key: str):
+    """Parse, profile and sample an upload in one streaming pass.
+
+    Every line feeds the sketches and the anomaly detector, which only read raw fields, so they get an
+    unvalidated view of the regex groups. The keep/drop decision is taken on that view too, and only kept
+    lines are validated, enriched and turned into Row objects: memory and CPU follow the sample, not the file.
+    """
+    report = ParseReport()
+    sketches = LogSketches()
+    detector = RateDetector()
+    sampler = Sampler(sample_rate, sample_key) if sample_rate < 1 else None
+    rows = []
+    for entry in iter_entries(read_lines(file), log_format, report):
+        view = RowDTO.model_construct(**entry.fields)
+        sketches.add(view)
+        detector.add(view)
+        weight = None
+        if sampler is not None:
+            weight = sampler.weight(view)
+            if weight is None:
+                report.accept()
+                continue
+        row_dto = to_row(entry, report)
+        if row_dto is None:
+            continue
+        row_dto.weight = weight
+        enrich(row_dto)
+        rows.append(Row(**row_dto.model_dump(exclude_none=True)))
+    finish_parse(rows, report, log_format)
+    return rows, sketches, [Anomaly(**finding) for finding in detector.finish()], report
+
 # POST: Upload a new Log File
-@router.post("/logs/upload")
-async def upload_log(file: UploadFile = File(...), db: Session = Depends(get_db)):
+@router.post("/logs/upload", dependencies=[Depends(mark_write)])
+async def upload_log(
+    file: UploadFile = File(...),
+    sample_rate: float = Query(1.0, gt=0, le=1),
+    sample_key: Literal[SAMPLE_KEYS] = "line",
+    log_format: Optional[LogFormatName] = Query(None, alias="format"),
+    db: Session = Depends(get_db)
+):
     try:
         if not file:
             raise HTTPException(status_code=400, detail="No file uploaded.")
 
-        # Read the file contents
-        contents = await file.read()
+        # Detect the format from the head of the file so a wrong-format upload fails before the full read and parse
+        prefix = await file.read(SNIFF_BYTES)
+        if log_format is None:
+            log_format, diagnosis = sniff_format(prefix.decode(errors="replace"), truncated=len(prefix) == SNIFF_BYTES)
+            if log_format is None:
+                raise HTTPException(
+                    status_code=400,
+                    detail={"message": f"Unrecognized log format, pass ?format= one of {list(FORMATS)}", **diagnosis},
+                )
+
+        # Stream the whole file through the detected format, keeping a deterministic, stratified sample if requested
+        await file.seek(0)
+        rows, sketches, anomalies, report = await run_in_threadpool(
+            read_upload, file.file, log_format, sample_rate, sample_key
+        )
 
-        # Process the Apache log file
-        row_dtos = parse_apache_log(contents.decode())
-        
-        # Convert Pydantic Row to SQLAlchemy Row objects
-        rows = [Row(**row_dto.model_dump()) for row_dto in row_dtos]
-        
         # Create and save the Log object
         log = Log(
             file_name=file.filename,
-            file_type="apache",
+            file_type=log_format,
+            sample_rate=sample_rate,
+            sketches=sketches.to_dict(),
+            parse_report=report.to_dict(),
+            anomalies=anomalies,
             rows=rows  # Associating ORM rows with the log
         )
         db.add(log)
@@ -105,7 +239,7 @@ async def upload_log(file: UploadFile = File(...), db: Session = Depends(get_db)
 
         # Convert log to LogDTO for response
         log_dto = LogDTO.model_validate(log)
-        return {"message": "Log uploaded successfully", "log": log_dto.model_dump()}
+        return {"message": "Log uploaded successfully", "log": log_dto.model_dump(), "parse_report": log.parse_report}
     except HTTPException as he:
         raise he  # Re-raise HTTPExceptions as-is
     except Exception as e:
@@ -113,29 +247,89 @@ async def upload_log(file: UploadFile = File(...), db: Session = Depends(get_db)
         raise HTTPException(status_code=500, detail=f"An unexpected error occurred while uploading the log: {e}")
     
 # GET: get a rows by log id
-@router.get("/logs/{log_id}/rows", response_model=list[RowDTO])
-def find_rows_by_log_id(log_id: int, db: Session = Depends(get_db)):
+@router.get("/logs/{log_id}/rows", response_model=list[RowDTO], dependencies=[Depends(conditional_log)])
+def find_rows_by_log_id(log_id: int, db: Session = Depends(get_read_db)):
     log = db.query(Log).filter(Log.id == log_id).first()
     if log is None:
         raise HTTPException(status_code=404, detail="Log not found")
-    rows = log.rows
+    rows = log_rows(db, log)
     return rows
 
+# GET: get approximate statistics by log id
+@router.get("/logs/{log_id}/approxstats", dependencies=[Depends(conditional_log)])
+def find_approx_stats_by_log_id(log_id: int, top: int = Query(10, ge=1, le=64), db: Session = Depends(get_read_db)):
+    log = db.query(Log).filter(Log.id == log_id).first()
+    if log is None:
+        raise HTTPException(status_code=404, detail="Log not found")
+    if not log.sketches:
+        raise HTTPException(status_code=409, detail="No approximate statistics stored for this log")
+    return LogSketches.from_dict(log.sketches).summary(top)
+
+# GET: get anomalies detected at ingest by log id
+@router.get("/logs/{log_id}/anomalies", response_model=list[AnomalyDTO], dependencies=[Depends(conditional_log)])
+def find_anomalies_by_log_id(log_id: int, kind: Literal["rate", "errors", "fanout"] = None, db: Session = Depends(get_read_db)):
+    log = db.query(Log).filter(Log.id == log_id).first()
+    if log is None:
+        raise HTTPException(status_code=404, detail="Log not found")
+    
+    query = db.query(Anomaly).filter(Anomaly.log_id == log_id)
+    if kind is not None:
+        query = query.filter(Anomaly.kind == kind)
+    return query.order_by(Anomaly.window_start).all()
+
+# GET: get the parse diagnostics (rejections per reason and sampled bad lines) recorded at upload
+@router.get("/logs/{log_id}/parse-report", dependencies=[Depends(conditional_log)])
+def find_parse_report_by_log_id(log_id: int, db: Session = Depends(get_read_db)):
+    log = db.query(Log).filter(Log.id == log_id).first()
+    if log is None:
+        raise HTTPException(status_code=404, detail="Log not found")
+    if log.parse_report is None:
+        raise HTTPException(status_code=404, detail="No parse report recorded for this log")
+    return log.parse_report
+
+# GET: group rows by any columns with filters, e.g. ?group_by=url,status&metric=count&where=status=500&n=10
+@router.get("/logs/{log_id}/aggregate", dependencies=[Depends(conditional_log)])
+def aggregate_rows_by_log_id(
+    log_id: int,
+    group_by: List[str] = Query(...),
+    metric: List[str] = Query(["count"]),
+    where: List[str] = Query([]),
+    n: int = Query(5, ge=1, le=1000),
+    engine: QueryEngine = "sql",
+    db: Session = Depends(get_read_db)
+):
+    log = db.query(Log).filter(Log.id == log_id).first()
+    if log is None:
+        raise HTTPException(status_code=404, detail="Log not found")
+
+    try:
+        if log.archived or engine == "numpy":
+            # Archived rows only exist as a column batch; the NumPy engine accepts the same request
+            batch = analytics.load_batch(db, log)
+            result = analytics.aggregate(batch, split_list(group_by), split_list(metric), where, n, weighted=log.sampled)
+        else:
+            statement = build_aggregate(log_id, split_list(group_by), split_list(metric), where, n, weighted=log.sampled)
+            rows = db.execute(statement)
+            result = {"columns": list(rows.keys()), "rows": [list(row) for row in rows.all()]}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return {
+        **result,
+        "estimated": log.sampled,
+        "sample_rate": log.sample_rate,
+    }
+
 # GET: get top status by log id
-@router.get("/logs/{log_id}/topstatus", response_model=list[dict[int, int]])
-def find_top_rows_by_log_id(log_id: int, db: Session = Depends(get_db)):
+@router.get("/logs/{log_id}/topstatus", response_model=list[dict[int, int]], dependencies=[Depends(conditional_log)])
+def find_top_rows_by_log_id(log_id: int, engine: QueryEngine = "sql", db: Session = Depends(get_read_db)):
     log = db.query(Log).filter(Log.id == log_id).first()
     
     if log is None:
         raise HTTPException(status_code=404, detail="Log not found")
     
     # Query to get the top 5 most frequent status codes with their counts
-    statuscodes = db.query(Row.status, func.count(Row.status).label('status_count')) \
-        .filter(Row.log_id == log_id) \
-        .group_by(Row.status) \
-        .order_by(func.count(Row.status).desc()) \
-        .limit(5) \
-        .all()
+    statuscodes = top_counts(db, log, Row.status, engine=engine)
     
     # Format the result as a list of dictionaries {status_code: count}
     top_status_codes = [{status[0]: status[1]} for status in statuscodes]
@@ -143,42 +337,37 @@ def find_top_rows_by_log_id(log_id: int, db: Session = Depends(get_db)):
     return top_status_codes
 
 # GET: get top rows that have top status by log id
-@router.get("/logs/{log_id}/rows/topstatus", response_model=list[RowDTO])
-def find_top_rows_by_log_id(log_id: int, db: Session = Depends(get_db)):
+@router.get("/logs/{log_id}/rows/topstatus", response_model=list[RowDTO], dependencies=[Depends(conditional_log)])
+def find_top_rows_by_log_id(log_id: int, engine: QueryEngine = "sql", db: Session = Depends(get_read_db)):
     log = db.query(Log).filter(Log.id == log_id).first()
     
     if log is None:
         raise HTTPException(status_code=404, detail="Log not found")
     
     # Query to get the top 5 most frequent status codes
-    statuscodes = db.query(Row.status).filter(Row.log_id == log_id) \
-        .group_by(Row.status) \
-        .order_by(func.count(Row.status).desc()) \
-        .limit(5) \
-        .all()
+    statuscodes = top_counts(db, log, Row.status, engine=engine)
     
     # Extract the status codes from the result
     top_status_codes = [status[0] for status in statuscodes]
     
     # Retrieve rows with those status codes and sort them
+    if log.archived:
+        batch = analytics.load_batch(db, log)
+        matches = batch.column("status").isin(top_status_codes).nonzero()[0]
+        return [RowDTO(**row) for row in batch.rows(matches)]
     top_rows = [row for row in log.rows if row.status in top_status_codes]
     
     return top_rows
 
 # GET: get top status by log id
-@router.get("/logs/{log_id}/toppaths", response_model=list[dict[str, int]])
-def find_top_paths_by_log_id(log_id: int, db: Session = Depends(get_db)):
+@router.get("/logs/{log_id}/toppaths", response_model=list[dict[str, int]], dependencies=[Depends(conditional_log)])
+def find_top_paths_by_log_id(log_id: int, engine: QueryEngine = "sql", db: Session = Depends(get_read_db)):
     log = db.query(Log).filter(Log.id == log_id).first()
     if log is None:
         raise HTTPException(status_code=404, detail="Log not found")
     
     # Query to get the top 5 most frequent paths with their counts
-    paths = db.query(Row.url, func.count(Row.url).label('path_count')) \
-        .filter(Row.log_id == log_id) \
-        .group_by(Row.url) \
-        .order_by(func.count(Row.url).desc()) \
-        .limit(5) \
-        .all()
+    paths = top_counts(db, log, Row.url, engine=engine)
     
     # Format the result as a list of dictionaries
     top_paths = [{path[0]: path[1]} for path in paths]
@@ -187,38 +376,28 @@ def find_top_paths_by_log_id(log_id: int, db: Session = Depends(get_db)):
 
 
 # GET: get top HTTP methods by log id
-@router.get("/logs/{log_id}/topmethods", response_model=list[dict[str, int]])
-def find_top_methods_by_log_id(log_id: int, db: Session = Depends(get_db)):
+@router.get("/logs/{log_id}/topmethods", response_model=list[dict[str, int]], dependencies=[Depends(conditional_log)])
+def find_top_methods_by_log_id(log_id: int, engine: QueryEngine = "sql", db: Session = Depends(get_read_db)):
     log = db.query(Log).filter(Log.id == log_id).first()
     if log is None:
         raise HTTPException(status_code=404, detail="Log not found")
     
     # Query to get the top 5 most frequent HTTP methods with their counts
-    methods = db.query(Row.method, func.count(Row.method).label('method_count')) \
-        .filter(Row.log_id == log_id) \
-        .group_by(Row.method) \
-        .order_by(func.count(Row.method).desc()) \
-        .limit(5) \
-        .all()
+    methods = top_counts(db, log, Row.method, engine=engine)
     
     # Format the results as a list of dictionaries
     top_methods = [{method[0]: method[1]} for method in methods]
     
     return top_methods
 # GET: get top IP's methods by log id
-@router.get("/logs/{log_id}/topips", response_model=list[dict[str, int]])
-def find_top_ips_by_log_id(log_id: int, db: Session = Depends(get_db)):
+@router.get("/logs/{log_id}/topips", response_model=list[dict[str, int]], dependencies=[Depends(conditional_log)])
+def find_top_ips_by_log_id(log_id: int, engine: QueryEngine = "sql", db: Session = Depends(get_read_db)):
     log = db.query(Log).filter(Log.id == log_id).first()
     if log is None:
         raise HTTPException(status_code=404, detail="Log not found")
     
     # Query to get the top 5 most frequent IP addresses with their counts
-    ips = db.query(Row.ip, func.count(Row.ip).label('ip_count')) \
-        .filter(Row.log_id == log_id) \
-        .group_by(Row.ip) \
-        .order_by(func.count(Row.ip).desc()) \
-        .limit(5) \
-        .all()
+    ips = top_counts(db, log, Row.ip, engine=engine)
     
     # Format the results as a list of dictionaries
     top_ips = [{ip[0]: ip[1]} for ip in ips]
@@ -226,19 +405,14 @@ def find_top_ips_by_log_id(log_id: int, db: Session = Depends(get_db)):
     return top_ips
 
 # GET: get top protocols methods by log id
-@router.get("/logs/{log_id}/topprotocols", response_model=list[dict[str, int]])
-def find_top_protocols_by_log_id(log_id: int, db: Session = Depends(get_db)):
+@router.get("/logs/{log_id}/topprotocols", response_model=list[dict[str, int]], dependencies=[Depends(conditional_log)])
+def find_top_protocols_by_log_id(log_id: int, engine: QueryEngine = "sql", db: Session = Depends(get_read_db)):
     log = db.query(Log).filter(Log.id == log_id).first()
     if log is None:
         raise HTTPException(status_code=404, detail="Log not found")
     
     # Query to get the top 5 most frequent protocols with their counts
-    protocols = db.query(Row.protocol, func.count(Row.protocol).label('protocol_count')) \
-        .filter(Row.log_id == log_id) \
-        .group_by(Row.protocol) \
-        .order_by(func.count(Row.protocol).desc()) \
-        .limit(5) \
-        .all()
+    protocols = top_counts(db, log, Row.protocol, engine=engine)
     
     # Format the results as a list of dictionaries
     top_protocols = [{protocol[0]: protocol[1]} for protocol in protocols]
@@ -246,44 +420,81 @@ def find_top_protocols_by_log_id(log_id: int, db: Session = Depends(get_db)):
     return top_protocols
 
 # GET: get top users methods by log id
-@router.get("/logs/{log_id}/topusers", response_model=list[dict[str, int]])
-def find_top_users_by_log_id(log_id: int, db: Session = Depends(get_db)):
+@router.get("/logs/{log_id}/topusers", response_model=list[dict[str, int]], dependencies=[Depends(conditional_log)])
+def find_top_users_by_log_id(log_id: int, engine: QueryEngine = "sql", db: Session = Depends(get_read_db)):
     log = db.query(Log).filter(Log.id == log_id).first()
     if log is None:
         raise HTTPException(status_code=404, detail="Log not found")
     
     # Query to get the top 5 most frequent users with their counts
-    users = db.query(Row.user, func.count(Row.user).label('user_count')) \
-        .filter(Row.log_id == log_id) \
-        .group_by(Row.user) \
-        .order_by(func.count(Row.user).desc()) \
-        .limit(5) \
-        .all()
+    users = top_counts(db, log, Row.user, engine=engine)
     
     # Format the results as a list of dictionaries
     top_users = [{user[0]: user[1]} for user in users]
     
     return top_users
 # GET: get top user agents methods by log id
-@router.get("/logs/{log_id}/topuseragents", response_model=list[dict[str, int]])
-def find_top_user_agents_by_log_id(log_id: int, db: Session = Depends(get_db)):
+@router.get("/logs/{log_id}/topuseragents", response_model=list[dict[str, int]], dependencies=[Depends(conditional_log)])
+def find_top_user_agents_by_log_id(log_id: int, engine: QueryEngine = "sql", db: Session = Depends(get_read_db)):
     log = db.query(Log).filter(Log.id == log_id).first()
     if log is None:
         raise HTTPException(status_code=404, detail="Log not found")
     
     # Query to get the top 5 most frequent user agents with their counts
-    user_agents = db.query(Row.user_agent, func.count(Row.user_agent).label('user_agent_count')) \
-        .filter(Row.log_id == log_id) \
-        .group_by(Row.user_agent) \
-        .order_by(func.count(Row.user_agent).desc()) \
-        .limit(5) \
-        .all()
+    user_agents = top_counts(db, log, Row.user_agent, engine=engine)
     
     # Format the results as a list of dictionaries
     top_user_agents = [{user_agent[0]: user_agent[1]} for user_agent in user_agents]
     
     return top_user_agents
 
+# GET: get top browsers by log id
+@router.get("/logs/{log_id}/topbrowsers", response_model=list[dict[str, int]], dependencies=[Depends(conditional_log)])
+def find_top_browsers_by_log_id(log_id: int, engine: QueryEngine = "sql", db: Session = Depends(get_read_db)):
+    log = db.query(Log).filter(Log.id == log_id).first()
+    if log is None:
+        raise HTTPException(status_code=404, detail="Log not found")
+
+    # Query to get the top 5 most frequent browsers with their counts
+    browsers = top_counts(db, log, Row.browser, engine=engine)
+
+    return [{browser[0]: browser[1]} for browser in browsers if browser[0] is not None]
+
+# GET: get top operating systems by log id
+@router.get("/logs/{log_id}/topos", response_model=list[dict[str, int]], dependencies=[Depends(conditional_log)])
+def find_top_os_by_log_id(log_id: int, engine: QueryEngine = "sql", db: Session = Depends(get_read_db)):
+    log = db.query(Log).filter(Log.id == log_id).first()
+    if log is None:
+        raise HTTPException(status_code=404, detail="Log not found")
+
+    # Query to get the top 5 most frequent operating systems with their counts
+    systems = top_counts(db, log, Row.os, engine=engine)
+
+    return [{system[0]: system[1]} for system in systems if system[0] is not None]
+
+# GET: get bot vs human request counts by log id
+@router.get("/logs/{log_id}/topagenttypes", response_model=list[dict[str, int]], dependencies=[Depends(conditional_log)])
+def find_top_agent_types_by_log_id(log_id: int, engine: QueryEngine = "sql", db: Session = Depends(get_read_db)):
+    log = db.query(Log).filter(Log.id == log_id).first()
+    if log is None:
+        raise HTTPException(status_code=404, detail="Log not found")
+
+    agent_types = top_counts(db, log, Row.agent_type, engine=engine)
+
+    return [{agent_type[0]: agent_type[1]} for agent_type in agent_types if agent_type[0] is not None]
+
+# GET: get top route templates by log id
+@router.get("/logs/{log_id}/toproutes", response_model=list[dict[str, int]], dependencies=[Depends(conditional_log)])
+def find_top_routes_by_log_id(log_id: int, engine: QueryEngine = "sql", db: Session = Depends(get_read_db)):
+    log = db.query(Log).filter(Log.id == log_id).first()
+    if log is None:
+        raise HTTPException(status_code=404, detail="Log not found")
+
+    # Query to get the top 5 most frequent route templates (/items/{id}) with their counts
+    routes = top_counts(db, log, Row.route, engine=engine)
+
+    return [{route[0]: route[1]} for route in routes if route[0] is not None]
+
 
 class FilterRequest(BaseModel):
     file_name: str
@@ -293,7 +504,7 @@ class FilterRequest(BaseModel):
 @router.post("/logs/rows/filtred", response_model=str)
 def find_filtred_rows_by_log_name_and_sed_command(
     request: FilterRequest,  # Use the request body model
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     file_name = request.file_name
     sed_command = request.sed_command
@@ -304,7 +515,8 @@ def find_filtred_rows_by_log_name_and_sed_command(
         raise HTTPException(status_code=404, detail="Log not found")
 
     # Check if the log has rows
-    if not log.rows:
+    rows = log_rows(db, log)
+    if not rows:
         raise HTTPException(status_code=400, detail="No rows found for the log")
 
     # Convert rows to a formatted string suitable for sed processing
@@ -313,10 +525,10 @@ def find_filtred_rows_by_log_name_and_sed_command(
             f"{row.ip} {row.remote_logname} {row.user} {row.timestamp} "
             f"{row.method} {row.url} {row.protocol} {row.status} "
             f"{row.response_size if row.response_size else '0'} {row.referer if row.referer else '-'} {row.user_agent}"
-            for row in log.rows
+            for row in rows
         )
     except AttributeError as e:
-        raise HTTPException(status_code=500, detail=f"Error formatting rows: {e} , {(log.rows[0])}")
+        raise HTTPException(status_code=500, detail=f"Error formatting rows: {e} , {(rows[0])}")
 
     try:
         # Use subprocess to apply the sed command on rows_data
@@ -338,13 +550,18 @@ def find_filtred_rows_by_log_name_and_sed_command(
         )
     
 # GET: get recent rows by log id
-@router.get("/logs/{log_id}/recentrows", response_model=list[RowDTO])
-def find_top_rows_by_log_id(log_id: int, db: Session = Depends(get_db)):
+@router.get("/logs/{log_id}/recentrows", response_model=list[RowDTO], dependencies=[Depends(conditional_log)])
+def find_top_rows_by_log_id(log_id: int, db: Session = Depends(get_read_db)):
     log = db.query(Log).filter(Log.id == log_id).first()
     
     if log is None:
         raise HTTPException(status_code=404, detail="Log not found")
     
+    if log.archived:
+        batch = analytics.load_batch(db, log)
+        recent = batch.column("id").values.argsort()[::-1][:10]
+        return [RowDTO(**row) for row in batch.rows(recent)]
+
     # Query to get the recent 10 rows ordered by row id
     rows = db.query(Row).filter(Row.log_id == log_id) \
         .order_by(Row.id.desc()) \
@@ -352,4 +569,47 @@ def find_top_rows_by_log_id(log_id: int, db: Session = Depends(get_db)):
         .all()
     
     # Return rows directly
-    return rows
\ No newline at end of file
+    return rows
+
+def load_log_batch(log_id: int, db: Session):
+    log = db.query(Log).filter(Log.id == log_id).first()
+    if log is None:
+        raise HTTPException(status_code=404, detail="Log not found")
+    return analytics.load_batch(db, log)
+
+def check_column(name: str):
+    if name not in ROW_COLUMNS:
+        raise HTTPException(status_code=400, detail=f"Unknown column: {name}")
+    return name
+
+# GET: get a cross-tab of two columns by log id
+@router.get("/logs/{log_id}/crosstab", dependencies=[Depends(conditional_log)])
+def find_crosstab_by_log_id(log_id: int, rows: str = "status", columns: str = "url", n: int = Query(10, ge=1, le=100), db: Session = Depends(get_read_db)):
+    batch = load_log_batch(log_id, db)
+    return analytics.crosstab(batch, check_column(rows), check_column(columns), n)
+
+# GET: get a histogram of a numeric column by log id
+@router.get("/logs/{log_id}/histogram", dependencies=[Depends(conditional_log)])
+def find_histogram_by_log_id(log_id: int, column: str = "response_size", bins: int = Query(20, ge=1, le=1000), db: Session = Depends(get_read_db)):
+    batch = load_log_batch(log_id, db)
+    try:
+        return analytics.histogram(batch, check_column(column), bins)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# GET: get percentiles of a numeric column by log id
+@router.get("/logs/{log_id}/percentiles", dependencies=[Depends(conditional_log)])
+def find_percentiles_by_log_id(log_id: int, column: str = "response_size", q: List[float] = Query([50, 90, 99]), db: Session = Depends(get_read_db)):
+    if any(value < 0 or value > 100 for value in q):
+        raise HTTPException(status_code=400, detail="Percentiles must be between 0 and 100")
+    batch = load_log_batch(log_id, db)
+    try:
+        return analytics.percentiles(batch, check_column(column), q)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# GET: get request rates of the busiest values of a column (IPs by default) by log id
+@router.get("/logs/{log_id}/rates", dependencies=[Depends(conditional_log)])
+def find_rates_by_log_id(log_id: int, key: str = "ip", n: int = Query(10, ge=1, le=1000), db: Session = Depends(get_read_db)):
+    batch = load_log_batch(log_id, db)
+    return analytics.rates(batch, check_column(key), n)
@@ -1,16 +1,81 @@
+import asyncio
+import json
+import logging
+import os
+import time
 from datetime import datetime
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from pydantic import ValidationError
+from sqlalchemy import insert
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 from models.rowEntity import Row   # Assuming this contains your Row model
-from db.database import get_db
+from models.logsEntity import Log
+from db.database import get_db, get_read_db, mark_write
 from schemas.rowDTO import RowDTO , RowCreate
+from tools import analytics
+from tools.sketches import LogSketches
+from tools.enrichment import ENRICHED_FIELDS, classify_user_agent, enrich, url_route
+from tools.parser import parse_timestamp
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# Micro-batching for the NDJSON ingest: flush after this many rows or seconds, whichever comes first
+INGEST_BATCH_ROWS = int(os.getenv("LASYS_INGEST_BATCH_ROWS", "5000"))
+INGEST_BATCH_SECONDS = float(os.getenv("LASYS_INGEST_BATCH_SECONDS", "1.0"))
+# Backpressure: at most this many batch inserts run at once; shippers wait this long for a slot before a 503
+INGEST_MAX_INFLIGHT = int(os.getenv("LASYS_INGEST_MAX_INFLIGHT", "4"))
+INGEST_WAIT_SECONDS = float(os.getenv("LASYS_INGEST_WAIT_SECONDS", "10"))
+# Longest accepted NDJSON line; longer ones are dropped as rejected instead of being buffered
+INGEST_MAX_LINE_BYTES = int(os.getenv("LASYS_INGEST_MAX_LINE_KB", "64")) * 1024
+
+ingest_slots = asyncio.Semaphore(INGEST_MAX_INFLIGHT)
+
+# Field names used by common shippers (Fluent Bit, Vector, nginx JSON logs) mapped onto Row columns
+FIELD_ALIASES = {
+    "remote_addr": "ip",
+    "client_ip": "ip",
+    "request_uri": "url",
+    "path": "url",
+    "request_method": "method",
+    "status_code": "status",
+    "body_bytes_sent": "response_size",
+    "bytes": "response_size",
+    "size": "response_size",
+    "http_referer": "referer",
+    "http_user_agent": "user_agent",
+    "agent": "user_agent",
+    "time": "timestamp",
+    "time_local": "timestamp",
+    "@timestamp": "timestamp",
+    "date": "timestamp",
+    "log": "message",
+}
+# Raw log fields a shipper may set; weight and the enrichment columns are always computed server side
+ROW_FIELDS = set(RowDTO.model_fields) - {"id", "log_id", "weight"} - set(ENRICHED_FIELDS)
+
+def lock_log(db: Session, log_id: int) -> Optional[Log]:
+    """Reload a log with its row locked until commit, so concurrent appends merge their sketches one at a time.
+
+    Pending rows are flushed first: SQLite has no FOR UPDATE and only serializes writers from their first write.
+    DuckDB rejects FOR UPDATE, but its optimistic MVCC fails the second of two conflicting updates instead.
+    """
+    db.flush()
+    return db.get(Log, log_id, with_for_update=db.get_bind(Log).dialect.name != "duckdb", populate_existing=True)
+
+def fold_sketches(log: Log, rows) -> None:
+    """Merge appended rows (Row objects or DTOs) into the log's approximate statistics; the log must be locked."""
+    sketches = LogSketches().update(rows)
+    if log.sketches:
+        sketches = LogSketches.from_dict(log.sketches).merge(sketches)
+    log.sketches = sketches.to_dict()
+
 # GET: Fetch all rows
 @router.get("/rows", response_model=List[RowDTO])
-def read_rows(db: Session = Depends(get_db)):
+def read_rows(db: Session = Depends(get_read_db)):
     try:
         rows = db.query(Row).all()
         return rows
@@ -19,7 +84,7 @@ def read_rows(db: Session = Depends(get_db)):
 
 # GET: Find rows by log_id
 @router.get("/rows/log/{log_id}", response_model=List[RowDTO])
-def find_rows_by_log_id(log_id: int, db: Session = Depends(get_db)):
+def find_rows_by_log_id(log_id: int, db: Session = Depends(get_read_db)):
 
     rows = db.query(Row).filter(Row.log_id == log_id).all()
     if not rows:
@@ -27,9 +92,10 @@ def find_rows_by_log_id(log_id: int, db: Session = Depends(get_db)):
     return rows
 
 # POST: Create a new row
-@router.post("/rows", response_model=RowDTO)
+@router.post("/rows", response_model=RowDTO, dependencies=[Depends(mark_write)])
 async def create_row(row: RowCreate, db: Session = Depends(get_db)):
     try :
+        browser, os_name, agent_type = classify_user_agent(row.user_agent)
         db_row = Row(
             ip=row.ip,
             url=row.url,
@@ -39,10 +105,19 @@ async def create_row(row: RowCreate, db: Session = Depends(get_db)):
             referer=row.referer,
             user_agent=row.user_agent,
             response_size=row.response_size,
+            browser=browser,
+            os=os_name,
+            agent_type=agent_type,
+            route=url_route(row.url),
+            epoch=parse_timestamp(row.timestamp),
             log_id=row.log_id  # Make sure log_id exists in the RowDTO schema
         )
 
         db.add(db_row)
+        log = lock_log(db, row.log_id) if row.log_id is not None else None
+        if log is not None:
+            fold_sketches(log, [db_row])
+            log.bump_version()
         db.commit()
         db.refresh(db_row)
 
@@ -66,11 +141,11 @@ async def create_row(row: RowCreate, db: Session = Depends(get_db)):
         )
 
 # POST: Create All Rows
-@router.post("/rows/all", response_model=List[RowDTO])
+@router.post("/rows/all", response_model=List[RowDTO], dependencies=[Depends(mark_write)])
 async def create_rows(rows: List[RowDTO], db: Session = Depends(get_db)):
     created_rows = []
     
-    for row in rows:
+    for row in map(enrich, rows):
         db_row = Row(
             ip=row.ip,
             url=row.url,
@@ -80,11 +155,22 @@ async def create_rows(rows: List[RowDTO], db: Session = Depends(get_db)):
             response_size=row.response_size,
             referer=row.referer,
             user_agent=row.user_agent,
+            browser=row.browser,
+            os=row.os,
+            agent_type=row.agent_type,
+            route=row.route,
             log_id=row.log_id
         )
         db.add(db_row)
         created_rows.append(db_row)
 
+    # Keep approxstats in step with rows appended to existing logs
+    for log_id in {row.log_id for row in created_rows if row.log_id is not None}:
+        log = lock_log(db, log_id)
+        if log is not None:
+            fold_sketches(log, [row for row in created_rows if row.log_id == log_id])
+            log.bump_version()
+
     db.commit()
 
     # Refresh each row to ensure the latest state is reflected
@@ -94,7 +180,7 @@ async def create_rows(rows: List[RowDTO], db: Session = Depends(get_db)):
     return created_rows
         
 # DELETE: Delete a row by ID
-@router.delete("/rows/{row_id}", response_model=RowDTO)
+@router.delete("/rows/{row_id}", response_model=RowDTO, dependencies=[Depends(mark_write)])
 def delete_row(row_id: int, db: Session = Depends(get_db)):
 
     db_row = db.query(Row).filter(Row.id == row_id).first()
@@ -103,6 +189,161 @@ def delete_row(row_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Row not found")
     
     db.delete(db_row)
+    log = db.get(Log, db_row.log_id) if db_row.log_id is not None else None
+    if log is not None:
+        log.bump_version()
     db.commit()
     
-    return db_row
\ No newline at end of file
+    return db_row
+
+def decode_record(line: bytes, log_id: int):
+    """Turn one JSON line into the column values of a Row, or None if it is not a valid record."""
+    try:
+        record = json.loads(line)
+    except ValueError:
+        return None
+    # Fluent Bit can emit [timestamp, record] pairs
+    if isinstance(record, list) and len(record) == 2 and isinstance(record[1], dict):
+        record = record[1]
+    if not isinstance(record, dict):
+        return None
+    fields = {}
+    for key, value in record.items():
+        key = FIELD_ALIASES.get(key, key)
+        if key in ROW_FIELDS and key not in fields:
+            fields[key] = value
+    if not fields:
+        return None
+    try:
+        row = RowDTO.model_validate(fields)
+    except ValidationError:
+        return None
+    values = enrich(row).model_dump(exclude={"id"})
+    values["log_id"] = log_id
+    if values["weight"] is None:
+        values["weight"] = 1.0
+    return values
+
+def insert_batch(db: Session, log: Log, batch: List[dict]):
+    """Bulk insert one micro-batch and fold it into the log's sketches in the same transaction."""
+    db.execute(insert(Row), batch)
+    log = lock_log(db, log.id)
+    if log.archived:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Log was archived during ingest")
+    fold_sketches(log, (RowDTO.model_construct(**values) for values in batch))
+    log.bump_version()
+    db.commit()
+
+def ingest_lines(db: Session, log: Log, lines: List[bytes]) -> int:
+    """Decode, validate, enrich and store one micro-batch of NDJSON lines; returns how many were valid records."""
+    batch = [values for values in (decode_record(line, log.id) for line in lines) if values is not None]
+    if batch:
+        insert_batch(db, log, batch)
+    return len(batch)
+
+# POST: Stream NDJSON rows from a log shipper into an existing log
+@router.post("/rows/ingest", dependencies=[Depends(mark_write)])
+async def ingest_rows(log_id: int, request: Request, db: Session = Depends(get_db)):
+    log = db.query(Log).filter(Log.id == log_id).first()
+    if log is None:
+        raise HTTPException(status_code=404, detail="Log not found")
+    if log.archived:
+        raise HTTPException(status_code=409, detail="Log is archived")
+
+    accepted = rejected = batches = 0
+    batch: List[bytes] = []
+    batch_started = time.monotonic()
+
+    async def flush():
+        nonlocal accepted, rejected, batches, batch
+        lines, batch = batch, []
+        try:
+            await asyncio.wait_for(ingest_slots.acquire(), timeout=INGEST_WAIT_SECONDS)
+        except asyncio.TimeoutError:
+            raise HTTPException(
+                status_code=503,
+                detail={"message": "Database is falling behind, retry later", "accepted": accepted, "rejected": rejected},
+                headers={"Retry-After": str(int(INGEST_WAIT_SECONDS))},
+            )
+        try:
+            # JSON decoding and validation run in the worker too, keeping the event loop free for other requests;
+            # at most one more chunk is read meanwhile, so TCP flow control slows the shipper down
+            stored = await run_in_threadpool(ingest_lines, db, log, lines)
+        finally:
+            ingest_slots.release()
+        accepted += stored
+        rejected += len(lines) - stored
+        if stored:
+            batches += 1
+
+    def take(line: bytes):
+        nonlocal rejected
+        line = line.strip()
+        if not line:
+            return
+        if len(line) > INGEST_MAX_LINE_BYTES:
+            rejected += 1
+            return
+        batch.append(line)
+
+    chunks = request.stream().__aiter__()
+
+    async def read_chunk() -> Optional[bytes]:
+        try:
+            return await chunks.__anext__()
+        except StopAsyncIteration:
+            return None
+
+    reading = None
+    try:
+        pending = b""
+        overlong = False  # Discarding the rest of a line that outgrew INGEST_MAX_LINE_BYTES
+        while True:
+            if reading is None:
+                reading = asyncio.ensure_future(read_chunk())
+            # Wake up when the batch is due even if the shipper goes quiet, rather than on its next chunk
+            timeout = max(0.0, batch_started + INGEST_BATCH_SECONDS - time.monotonic()) if batch else None
+            done, _ = await asyncio.wait({reading}, timeout=timeout)
+            if not done:
+                await flush()
+                continue
+            chunk, reading = reading.result(), None
+            if chunk is None:
+                break
+            lines = (pending + chunk).split(b"\n")
+            pending = lines.pop()
+            if overlong and lines:
+                lines.pop(0)
+                overlong = False
+            for line in lines:
+                if not batch:
+                    batch_started = time.monotonic()
+                take(line)
+            if len(pending) > INGEST_MAX_LINE_BYTES:
+                if not overlong:
+                    rejected += 1
+                overlong = True
+                pending = b""
+            if len(batch) >= INGEST_BATCH_ROWS or (batch and time.monotonic() - batch_started >= INGEST_BATCH_SECONDS):
+                await flush()
+        if not overlong:
+            take(pending)
+        if batch:
+            await flush()
+    except HTTPException:
+        raise
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Error occurred while ingesting rows into log {log_id}: {e}")
+        raise HTTPException(
+            status_code=500,
+            detail={"message": f"An error occurred while ingesting rows: {e}", "accepted": accepted, "rejected": rejected},
+        )
+    finally:
+        if reading is not None:
+            reading.cancel()
+        if accepted:
+            analytics.cache.invalidate(log_id)
+
+    return {"log_id": log_id, "accepted": accepted, "rejected": rejected, "batches": batches}
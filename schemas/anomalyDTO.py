@@ -0,0 +1,15 @@
+from typing import Optional
+from pydantic import BaseModel
+
+class AnomalyDTO(BaseModel):
+    id: Optional[int] = None
+    ip: Optional[str] = None
+    kind: Optional[str] = None
+    window_start: Optional[str] = None
+    window_end: Optional[str] = None
+    peak: Optional[int] = None
+    threshold: Optional[int] = None
+    log_id: Optional[int] = None
+
+    class Config:
+        from_attributes = True
@@ -8,6 +8,8 @@ class LogDTO(BaseModel):
     log_of: Optional[str] = None
     file_name: Optional[str] = None
     file_type: Optional[str] = None
+    archived: bool = False
+    sample_rate: Optional[float] = None
 
     class Config:
         from_attributes = True
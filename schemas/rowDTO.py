@@ -23,6 +23,12 @@ class RowDTO(BaseModel):
     user: Optional[str] = None
     request: Optional[str] = None
     pid_tid: Optional[str] = None
+    browser: Optional[str] = None
+    os: Optional[str] = None
+    agent_type: Optional[str] = None
+    route: Optional[str] = None
+    epoch: Optional[float] = None
+    weight: Optional[float] = None
 
     class Config:
         from_attributes = True  # Allow SQLAlchemy models to be converted to Pydantic models
@@ -0,0 +1,153 @@
+import operator
+import re
+from datetime import datetime, timezone
+from typing import List, NamedTuple, Optional, Sequence
+
+from sqlalchemy import Column, Float, Integer, case, func, select
+
+from models.rowEntity import Row
+from tools.parser import parse_timestamp
+
+COLUMNS = {column.key: column for column in Row.__table__.columns}
+
+# Column types that filters coerce and sum/avg accept
+NUMERIC_TYPES = (Integer, Float)
+
+METRICS = {"sum": func.sum, "avg": func.avg, "min": func.min, "max": func.max}
+
+# Filter operators; they apply equally to SQL columns and NumPy arrays
+OPERATORS = {
+    "=": operator.eq,
+    "!=": operator.ne,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+}
+RANGE_OPS = (">", ">=", "<", "<=")
+
+WHERE_PATTERN = re.compile(r"^(?P<column>\w+)(?P<op>!=|>=|<=|=|>|<|~)(?P<value>.*)$")
+METRIC_PATTERN = re.compile(r"^(?P<fn>\w+)\((?P<column>\w+)\)$")
+
+
+def split_list(values: Sequence[str]) -> List[str]:
+    """Accept both repeated query parameters and comma separated values."""
+    return [part.strip() for value in values for part in value.split(",") if part.strip()]
+
+
+def _column(name: str):
+    column = COLUMNS.get(name)
+    if column is None:
+        raise ValueError(f"Unknown column: {name}")
+    return column
+
+
+def _coerce(column, value: str):
+    if isinstance(column.type, Integer):
+        try:
+            return int(value)
+        except ValueError:
+            raise ValueError(f"Column {column.key} expects an integer, got {value!r}")
+    if isinstance(column.type, Float):
+        try:
+            return float(value)
+        except ValueError:
+            raise ValueError(f"Column {column.key} expects a number, got {value!r}")
+    return value
+
+
+def _epoch(value: str) -> float:
+    """Read a time bound as epoch seconds: a number, ISO 8601 (UTC unless an offset is given) or a raw log timestamp."""
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    seconds = parse_timestamp(value)
+    if seconds is not None:
+        return seconds
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"Cannot read {value!r} as a time; use epoch seconds, ISO 8601 or the log's own layout")
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+
+class Metric(NamedTuple):
+    fn: str                   # "count", or a key of METRICS
+    column: Optional[Column]  # None for count
+    label: str
+
+
+class Filter(NamedTuple):
+    column: Column
+    op: str                   # a key of OPERATORS, or "~" for contains
+    value: object
+
+
+def metric_spec(text: str) -> Metric:
+    """Validate one metric expression: count, sum(col), avg(col), min(col) or max(col)."""
+    if text == "count":
+        return Metric("count", None, "count")
+    match = METRIC_PATTERN.match(text)
+    if match is None or match["fn"] not in METRICS:
+        raise ValueError(f"Unsupported metric: {text} (use count, sum(col), avg(col), min(col) or max(col))")
+    fn, column = match["fn"], _column(match["column"])
+    if fn in ("sum", "avg") and not isinstance(column.type, NUMERIC_TYPES):
+        raise ValueError(f"Metric {text} requires a numeric column")
+    return Metric(fn, column, f"{fn}_{column.key}")
+
+
+def where_spec(text: str) -> Filter:
+    """Validate one filter and coerce its value; time ranges on timestamp are moved onto the numeric epoch column."""
+    match = WHERE_PATTERN.match(text)
+    if match is None:
+        raise ValueError(f"Invalid filter: {text} (expected <column><op><value>, op one of = != > >= < <= ~)")
+    column = _column(match["column"])
+    op, value = match["op"], match["value"]
+    if op == "~":
+        return Filter(column, op, value)
+    # The raw timestamp text does not sort chronologically ("01/Feb" < "31/Jan"), so never compare it as a string
+    if column is COLUMNS["timestamp"] and op in RANGE_OPS:
+        return Filter(COLUMNS["epoch"], op, _epoch(value))
+    return Filter(column, op, _coerce(column, value))
+
+
+def parse_request(group_by: Sequence[str], metrics: Sequence[str], where: Sequence[str]):
+    """Validate a group-by request into (key columns, metrics, filters), whichever engine then runs it."""
+    if not group_by:
+        raise ValueError("group_by needs at least one column")
+    keys = [_column(name) for name in group_by]
+    return keys, [metric_spec(metric) for metric in (metrics or ["count"])], [where_spec(condition) for condition in where]
+
+
+def compile_metric(metric: Metric, weighted: bool = False):
+    """Compile a metric; weighted metrics scale each row by Row.weight to estimate the full log."""
+    fn, column, label = metric
+    if fn == "count":
+        return (func.sum(Row.weight) if weighted else func.count()).label(label)
+    if weighted and fn == "sum":
+        return func.sum(column * Row.weight).label(label)
+    if weighted and fn == "avg":
+        return (func.sum(column * Row.weight) / func.sum(case((column.isnot(None), Row.weight)))).label(label)
+    return METRICS[fn](column).label(label)
+
+
+def compile_filter(condition: Filter):
+    column, op, value = condition
+    if op == "~":
+        return column.contains(value, autoescape=True)
+    return OPERATORS[op](column, value)
+
+
+def build_aggregate(log_id: int, group_by: Sequence[str], metrics: Sequence[str], where: Sequence[str], n: int,
+                    weighted: bool = False):
+    """Compile a group-by request into one parameterized SELECT filtered on log_id first."""
+    keys, metrics, filters = parse_request(group_by, metrics, where)
+    aggregates = [compile_metric(metric, weighted) for metric in metrics]
+    return select(*keys, *aggregates) \
+        .where(Row.log_id == log_id, *(compile_filter(condition) for condition in filters)) \
+        .group_by(*keys) \
+        .order_by(aggregates[0].desc()) \
+        .limit(n)
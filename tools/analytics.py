@@ -0,0 +1,293 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from models.logsEntity import Log
+from models.rowEntity import Row
+from tools.aggregate import OPERATORS, Filter, Metric, parse_request
+from tools.archive import load_archive
+from tools.columnar import ColumnBatch, NumericColumn, StringColumn
+from tools.parser import parse_timestamp
+
+# Upper bound on the memory held by cached column batches
+CACHE_BYTES = int(os.getenv("LASYS_ANALYTICS_CACHE_MB", "256")) * 1024 * 1024
+
+
+class BatchCache:
+    """LRU cache of column batches evicting the least recently used logs once the byte budget is exceeded.
+
+    Entries are tagged with the log version they were loaded at, so any write that bumps Log.version
+    (in this worker or another one) makes the cached batch unreachable without an explicit invalidate.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        self._batches: "OrderedDict[int, Tuple[int, ColumnBatch]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, log_id: int, version: int) -> Optional[ColumnBatch]:
+        with self._lock:
+            entry = self._batches.get(log_id)
+            if entry is None or entry[0] != version:
+                return None
+            self._batches.move_to_end(log_id)
+            return entry[1]
+
+    def put(self, log_id: int, version: int, batch: ColumnBatch) -> None:
+        size = batch.nbytes
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            entry = self._batches.get(log_id)
+            if entry is not None and entry[0] > version:
+                return  # Loaded from a lagging replica; keep the newer batch
+            self._discard(log_id)
+            self._batches[log_id] = (version, batch)
+            self.used_bytes += size
+            while self.used_bytes > self.max_bytes:
+                _, (_, evicted) = self._batches.popitem(last=False)
+                self.used_bytes -= evicted.nbytes
+
+    def invalidate(self, log_id: int) -> None:
+        with self._lock:
+            self._discard(log_id)
+
+    def _discard(self, log_id: int) -> None:
+        entry = self._batches.pop(log_id, None)
+        if entry is not None:
+            self.used_bytes -= entry[1].nbytes
+
+
+cache = BatchCache(CACHE_BYTES)
+
+
+def load_batch(db: Session, log: Log) -> ColumnBatch:
+    """Load every column of a log once, from cold storage or the row table, and keep it cached."""
+    version = log.version or 0
+    batch = cache.get(log.id, version)
+    if batch is None:
+        if log.archived:
+            # Archived batches share the byte budget: their string dictionaries are loaded, not mapped
+            batch = load_archive(log)
+        else:
+            names = [column.key for column in Row.__table__.columns]
+            records = db.execute(select(*Row.__table__.columns).where(Row.log_id == log.id)).all()
+            batch = ColumnBatch.from_records(names, records)
+        cache.put(log.id, version, batch)
+    return batch
+
+
+def numeric_values(batch: ColumnBatch, name: str):
+    """Return the non-null values of a numeric column and their weights (None if unweighted)."""
+    column = batch.column(name)
+    if not isinstance(column, NumericColumn):
+        raise ValueError(f"Column {name} is not numeric")
+    valid = column.valid
+    weights = batch.weights
+    return (
+        np.asarray(column.values[valid], dtype=np.float64),
+        None if weights is None else weights[valid],
+    )
+
+
+def _axis(batch: ColumnBatch, name: str, n: int):
+    """Return integer codes for a column restricted to its n most frequent values (-1 elsewhere)."""
+    column = batch.column(name)
+    keys, counts = column.counts(batch.weights)
+    order = np.argsort(-counts, kind="stable")[:n]
+    order = order[counts[order] > 0]
+    if isinstance(column, StringColumn):
+        raw = np.asarray(column.codes)
+    else:
+        # Map each value onto its position among the distinct values
+        raw = np.full(batch.n_rows, -1, dtype=np.int64)
+        valid = column.valid
+        raw[valid] = np.searchsorted(np.asarray(keys), column.values[valid])
+    remap = np.full(len(keys) + 1, -1, dtype=np.int64)
+    remap[order] = np.arange(len(order))
+    return [keys[i] for i in order], remap[raw]
+
+
+def crosstab(batch: ColumnBatch, rows: str, columns: str, n: int = 10) -> Dict[str, list]:
+    """Count rows for each pair of values of two columns, limited to the n most frequent values per axis."""
+    row_keys, row_codes = _axis(batch, rows, n)
+    col_keys, col_codes = _axis(batch, columns, n)
+    keep = (row_codes >= 0) & (col_codes >= 0)
+    flat = row_codes[keep] * len(col_keys) + col_codes[keep]
+    weights = batch.weights
+    counts = np.bincount(
+        flat,
+        weights=None if weights is None else weights[keep],
+        minlength=len(row_keys) * len(col_keys),
+    )
+    return {
+        "rows": row_keys,
+        "columns": col_keys,
+        "counts": np.rint(counts).astype(np.int64).reshape(len(row_keys), len(col_keys)).tolist(),
+    }
+
+
+def histogram(batch: ColumnBatch, name: str, bins: int = 20) -> Dict[str, list]:
+    values, weights = numeric_values(batch, name)
+    counts, edges = np.histogram(values, bins=bins, weights=weights)
+    return {"edges": edges.tolist(), "counts": np.rint(counts).astype(np.int64).tolist()}
+
+
+def percentiles(batch: ColumnBatch, name: str, qs: Sequence[float]) -> Dict[str, Optional[float]]:
+    values, weights = numeric_values(batch, name)
+    if values.size == 0:
+        return {str(q): None for q in qs}
+    if weights is None:
+        results = np.percentile(values, qs)
+    else:
+        results = np.percentile(values, qs, weights=weights, method="inverted_cdf")
+    return {str(q): float(value) for q, value in zip(qs, results)}
+
+
+def epoch_seconds(batch: ColumnBatch) -> np.ndarray:
+    """Epoch seconds of every row (NaN where the timestamp is missing or unreadable)."""
+    timestamps = batch.column("timestamp")
+    # Timestamps are dictionary encoded, so each distinct string is parsed only once
+    parsed = [parse_timestamp(value) for value in timestamps.dictionary]
+    lookup = np.asarray([np.nan if ts is None else ts for ts in parsed] + [np.nan], dtype=np.float64)
+    return lookup[np.asarray(timestamps.codes)]
+
+
+def rates(batch: ColumnBatch, key: str = "ip", n: int = 10) -> List[dict]:
+    """Requests per second for the n busiest values of a column, over each value's active time span."""
+    seconds = epoch_seconds(batch)
+    keys, codes = _axis(batch, key, n)
+    keep = (codes >= 0) & ~np.isnan(seconds)
+    codes, seconds = codes[keep], seconds[keep]
+    weights = batch.weights
+    counts = np.bincount(codes, weights=None if weights is None else weights[keep], minlength=len(keys))
+    first = np.full(len(keys), np.inf)
+    last = np.full(len(keys), -np.inf)
+    np.minimum.at(first, codes, seconds)
+    np.maximum.at(last, codes, seconds)
+
+    results = []
+    for i, value in enumerate(keys):
+        if counts[i] == 0:
+            continue
+        span = max(last[i] - first[i], 1.0)
+        results.append({
+            key: value,
+            "requests": int(round(counts[i])),
+            "span_seconds": float(last[i] - first[i]),
+            "requests_per_second": float(counts[i] / span),
+        })
+    return results
+
+
+def _filter_mask(batch: ColumnBatch, condition: Filter) -> np.ndarray:
+    """Rows matching one filter; like SQL, a NULL never matches."""
+    name, op, value = condition.column.key, condition.op, condition.value
+    if name == "epoch":
+        # Derived from the timestamp text so archives written before the epoch column filter the same way
+        seconds = epoch_seconds(batch)
+        with np.errstate(invalid="ignore"):
+            return OPERATORS[op](seconds, value) & ~np.isnan(seconds)
+    column = batch.column(name)
+    if isinstance(column, StringColumn):
+        # Evaluate the condition once per distinct value, then look every row up by its code (-1 hits the False tail)
+        if op == "~":
+            matches = [value in entry for entry in column.dictionary]
+        else:
+            matches = [OPERATORS[op](entry, value) for entry in column.dictionary]
+        return np.asarray(matches + [False], dtype=bool)[np.asarray(column.codes)]
+    valid = column.valid
+    if op == "~":
+        uniques, inverse = np.unique(column.values, return_inverse=True)
+        matches = np.asarray([value in str(unique.item()) for unique in uniques], dtype=bool)
+        return matches[inverse] & valid
+    return OPERATORS[op](column.values, value) & valid
+
+
+def _group_codes(column, mask: np.ndarray):
+    """Distinct values of a column among the masked rows (None last) and each row's position in them."""
+    if isinstance(column, StringColumn):
+        keys = list(column.dictionary)
+        codes = np.asarray(column.codes[mask], dtype=np.int64)
+    else:
+        valid = column.valid[mask]
+        uniques, inverse = np.unique(column.values[mask][valid], return_inverse=True)
+        keys = [unique.item() for unique in uniques]
+        codes = np.full(len(valid), -1, dtype=np.int64)
+        codes[valid] = inverse
+    codes[codes < 0] = len(keys)
+    return keys + [None], codes
+
+
+def _metric(batch: ColumnBatch, metric: Metric, mask: np.ndarray, groups: np.ndarray, n_groups: int,
+            weights: Optional[np.ndarray]) -> list:
+    """One aggregate per group, with SQL semantics: NULLs are skipped and an all-NULL group yields None."""
+    if metric.fn == "count":
+        counts = np.bincount(groups, weights=weights, minlength=n_groups)
+        return counts.tolist() if weights is not None else [int(count) for count in counts]
+    column = batch.column(metric.column.key)
+    if isinstance(column, StringColumn):
+        # min/max of strings: compare ranks in the sorted dictionary
+        order = sorted(range(len(column.dictionary)), key=column.dictionary.__getitem__)
+        ranks = np.empty(len(order), dtype=np.float64)
+        ranks[order] = np.arange(len(order))
+        codes = np.asarray(column.codes[mask])
+        valid = codes >= 0
+        values = np.zeros(len(codes), dtype=np.float64)
+        values[valid] = ranks[codes[valid]]
+        decode = lambda rank: column.dictionary[order[int(rank)]]
+    else:
+        valid = column.valid[mask]
+        values = np.asarray(column.values[mask], dtype=np.float64)
+        exact = column.kind == "int" and (weights is None or metric.fn in ("min", "max"))
+        decode = (lambda v: int(round(v))) if exact else float
+    present = np.bincount(groups[valid], minlength=n_groups) > 0
+    if metric.fn in ("sum", "avg"):
+        scaled = values[valid] if weights is None else values[valid] * weights[valid]
+        results = np.bincount(groups[valid], weights=scaled, minlength=n_groups)
+        if metric.fn == "avg":
+            totals = np.bincount(groups[valid], weights=None if weights is None else weights[valid], minlength=n_groups)
+            results = np.divide(results, totals, out=np.zeros(n_groups), where=totals > 0)
+            decode = float
+    elif metric.fn == "min":
+        results = np.full(n_groups, np.inf)
+        np.minimum.at(results, groups[valid], values[valid])
+    else:
+        results = np.full(n_groups, -np.inf)
+        np.maximum.at(results, groups[valid], values[valid])
+    return [decode(result) if ok else None for result, ok in zip(results, present)]
+
+
+def aggregate(batch: ColumnBatch, group_by: Sequence[str], metrics: Sequence[str], where: Sequence[str], n: int,
+              weighted: bool = False) -> Dict[str, list]:
+    """Run a group-by request over a column batch; same request syntax and result shape as the SQL aggregate."""
+    keys, metrics, filters = parse_request(group_by, metrics, where)
+    mask = np.ones(batch.n_rows, dtype=bool)
+    for condition in filters:
+        mask &= _filter_mask(batch, condition)
+    axes = [_group_codes(batch.column(key.key), mask) for key in keys]
+    if mask.any():
+        distinct, groups = np.unique(np.stack([codes for _, codes in axes], axis=1), axis=0, return_inverse=True)
+        groups = groups.reshape(-1)
+    else:
+        distinct, groups = np.empty((0, len(axes)), dtype=np.int64), np.empty(0, dtype=np.int64)
+    weights = None
+    if weighted:
+        weights = batch.weights[mask] if batch.weights is not None else np.ones(int(mask.sum()))
+    columns = [_metric(batch, metric, mask, groups, len(distinct), weights) for metric in metrics]
+
+    # Order by the first metric, largest first with NULLs last, as the SQL engine does
+    first = columns[0]
+    order = sorted((i for i in range(len(distinct)) if first[i] is not None), key=first.__getitem__, reverse=True)
+    order += [i for i in range(len(distinct)) if first[i] is None]
+    rows = [
+        [axis_keys[code] for (axis_keys, _), code in zip(axes, distinct[i])] + [column[i] for column in columns]
+        for i in order[:n]
+    ]
+    return {"columns": [key.key for key in keys] + [metric.label for metric in metrics], "rows": rows}
@@ -0,0 +1,171 @@
+import os
+from collections import Counter, OrderedDict, deque
+from datetime import datetime, timezone
+from typing import Iterable, List, Optional
+
+from tools.parser import parse_timestamp
+
+# Sliding window length and per-IP thresholds within one window
+WINDOW_SECONDS = float(os.getenv("LASYS_ANOMALY_WINDOW_SECONDS", "60"))
+MAX_REQUESTS = int(os.getenv("LASYS_ANOMALY_MAX_REQUESTS", "300"))
+MAX_ERRORS = int(os.getenv("LASYS_ANOMALY_MAX_ERRORS", "50"))
+MAX_PATHS = int(os.getenv("LASYS_ANOMALY_MAX_PATHS", "100"))
+# Memory bounds: number of IPs tracked at once, and findings kept per IP and kind and in total
+MAX_KEYS = int(os.getenv("LASYS_ANOMALY_MAX_KEYS", "50000"))
+MAX_FINDINGS_PER_KEY = int(os.getenv("LASYS_ANOMALY_MAX_FINDINGS_PER_KEY", "10"))
+MAX_FINDINGS = int(os.getenv("LASYS_ANOMALY_MAX_FINDINGS", "10000"))
+# Distinct paths remembered per IP, as a multiple of the fan-out threshold; fan-out saturates there
+PATHS_PER_THRESHOLD = 4
+
+
+def _iso(seconds: float) -> str:
+    return datetime.fromtimestamp(seconds, tz=timezone.utc).isoformat()
+
+
+class _KeyState:
+    __slots__ = ("buckets", "requests", "errors", "paths", "last_seen", "open")
+
+    def __init__(self):
+        # [second, requests, errors] per second within the window, so memory is bounded by the
+        # window length rather than by the request rate
+        self.buckets = deque()
+        self.requests = 0
+        self.errors = 0
+        self.paths = OrderedDict()  # url -> last second seen, least recent first
+        self.last_seen = None
+        self.open = {}  # kind -> finding still above its threshold
+
+
+class RateDetector:
+    """Single-pass per-IP sliding-window detector for request rates, 4xx/5xx bursts and path fan-out.
+
+    Each IP keeps per-second counters and a capped set of recent paths, IPs idle for longer than
+    the window are evicted, at most max_keys IPs are tracked, and repeated findings for one IP and
+    kind are merged once MAX_FINDINGS_PER_KEY is reached, so memory stays bounded whatever the size
+    of the log or the rate of a single client.
+    """
+
+    def __init__(self, window_seconds: float = WINDOW_SECONDS, max_requests: int = MAX_REQUESTS,
+                 max_errors: int = MAX_ERRORS, max_paths: int = MAX_PATHS, max_keys: int = MAX_KEYS):
+        self.window_seconds = window_seconds
+        self.thresholds = {"rate": max_requests, "errors": max_errors, "fanout": max_paths}
+        self.max_keys = max_keys
+        self.states: "OrderedDict[str, _KeyState]" = OrderedDict()
+        self.max_paths = max_paths * PATHS_PER_THRESHOLD
+        self.findings: List[dict] = []
+        self.reported = Counter()  # (ip, kind) -> findings recorded
+        self.last_finding = {}     # (ip, kind) -> latest recorded finding, merged into once capped
+        self.dropped = 0
+        self.now: Optional[float] = None
+        self._seen = 0
+
+    def add(self, row) -> None:
+        ts = parse_timestamp(row.timestamp)
+        if ts is None or row.ip is None:
+            return
+
+        state = self.states.get(row.ip)
+        if state is None:
+            state = self.states[row.ip] = _KeyState()
+        else:
+            self.states.move_to_end(row.ip)
+            # Lines are only roughly ordered; never move an IP's clock backwards
+            ts = max(ts, state.last_seen)
+        state.last_seen = ts
+
+        is_error = row.status is not None and row.status >= 400
+        second = int(ts)
+        if state.buckets and state.buckets[-1][0] == second:
+            bucket = state.buckets[-1]
+        else:
+            bucket = [second, 0, 0]
+            state.buckets.append(bucket)
+        bucket[1] += 1
+        bucket[2] += is_error
+        state.requests += 1
+        state.errors += is_error
+        if row.url is not None:
+            state.paths[row.url] = second
+            state.paths.move_to_end(row.url)
+            if len(state.paths) > self.max_paths:
+                state.paths.popitem(last=False)
+        self._expire(state, ts)
+        self._check(row.ip, state, ts)
+
+        self.now = ts if self.now is None else max(self.now, ts)
+        self._seen += 1
+        if self._seen % 1024 == 0 or len(self.states) > self.max_keys:
+            self._evict()
+
+    def update(self, rows: Iterable) -> "RateDetector":
+        for row in rows:
+            self.add(row)
+        return self
+
+    def finish(self) -> List[dict]:
+        """Close every open finding and return all findings ordered by window start."""
+        for state in self.states.values():
+            self._close_all(state)
+        self.states.clear()
+        return sorted(self.findings, key=lambda finding: (finding["window_start"], finding["ip"]))
+
+    def _expire(self, state: _KeyState, ts: float) -> None:
+        horizon = ts - self.window_seconds
+        while state.buckets and state.buckets[0][0] < horizon:
+            _, requests, errors = state.buckets.popleft()
+            state.requests -= requests
+            state.errors -= errors
+        while state.paths and next(iter(state.paths.values())) < horizon:
+            state.paths.popitem(last=False)
+
+    def _check(self, ip: str, state: _KeyState, ts: float) -> None:
+        values = {"rate": state.requests, "errors": state.errors, "fanout": len(state.paths)}
+        for kind, value in values.items():
+            finding = state.open.get(kind)
+            if value >= self.thresholds[kind]:
+                if finding is None:
+                    state.open[kind] = {
+                        "ip": ip,
+                        "kind": kind,
+                        "window_start": state.buckets[0][0],
+                        "window_end": ts,
+                        "peak": value,
+                        "threshold": self.thresholds[kind],
+                    }
+                else:
+                    finding["window_end"] = ts
+                    finding["peak"] = max(finding["peak"], value)
+            elif finding is not None:
+                self._close(state, kind)
+
+    def _close(self, state: _KeyState, kind: str) -> None:
+        finding = state.open.pop(kind)
+        finding["window_start"] = _iso(finding["window_start"])
+        finding["window_end"] = _iso(finding["window_end"])
+        key = (finding["ip"], kind)
+        if self.reported[key] >= MAX_FINDINGS_PER_KEY:
+            # A flapping client: stretch its last finding instead of recording another one
+            last = self.last_finding[key]
+            last["window_end"] = finding["window_end"]
+            last["peak"] = max(last["peak"], finding["peak"])
+            return
+        if len(self.findings) >= MAX_FINDINGS:
+            self.dropped += 1
+            return
+        self.reported[key] += 1
+        self.last_finding[key] = finding
+        self.findings.append(finding)
+
+    def _close_all(self, state: _KeyState) -> None:
+        for kind in list(state.open):
+            self._close(state, kind)
+
+    def _evict(self) -> None:
+        # States are kept in least-recently-seen order, so idle IPs are at the front
+        horizon = self.now - self.window_seconds
+        while self.states:
+            ip, state = next(iter(self.states.items()))
+            if state.last_seen >= horizon and len(self.states) <= self.max_keys:
+                break
+            self._close_all(state)
+            del self.states[ip]
@@ -0,0 +1,62 @@
+import os
+import shutil
+from typing import Optional
+
+from fastapi import HTTPException
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+from models.logsEntity import Log
+from models.rowEntity import Row
+from tools.columnar import ColumnBatch, open_batch, write_batch
+
+# Directory holding one columnar sub-directory per archived log
+ARCHIVE_DIR = os.getenv("LASYS_ARCHIVE_DIR", "archive")
+
+
+def archive_path(log_id: int) -> str:
+    return os.path.join(ARCHIVE_DIR, f"log_{log_id}")
+
+
+def archive_log(db: Session, log: Log) -> int:
+    """Move the rows of a log into a columnar file on disk and delete them from the database."""
+    path = archive_path(log.id)
+    # Claim the log before reading anything: a concurrent archive request matches no row here
+    # (it waits on the row lock where the database has one) and must not overwrite our files
+    claimed = db.execute(
+        update(Log)
+        .where(Log.id == log.id, Log.archive_path.is_(None))
+        .values(archive_path=path)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not claimed:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Log is already archived")
+
+    names = [column.key for column in Row.__table__.columns]
+    records = db.execute(
+        select(*Row.__table__.columns).where(Row.log_id == log.id).order_by(Row.id)
+    ).all()
+    batch = ColumnBatch.from_records(names, records)
+
+    try:
+        write_batch(batch, path)
+        db.query(Row).filter(Row.log_id == log.id).delete(synchronize_session=False)
+        log.archive_path = path
+        log.bump_version()
+        db.commit()
+    except Exception:
+        db.rollback()
+        shutil.rmtree(path, ignore_errors=True)
+        raise
+    return batch.n_rows
+
+
+def load_archive(log: Log) -> ColumnBatch:
+    """Open the memory-mapped columns of an archived log; callers cache it through analytics.load_batch."""
+    return open_batch(log.archive_path)
+
+
+def drop_archive(path: Optional[str]) -> None:
+    if path:
+        shutil.rmtree(path, ignore_errors=True)
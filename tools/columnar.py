@@ -0,0 +1,274 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import Boolean, Float, Integer
+
+from models.rowEntity import Row
+from tools.enrichment import ENRICHED_FIELDS, derived_fields
+
+# Sentinel used for NULL in fixed-width integer columns
+INT_NULL = np.iinfo(np.int64).min
+
+MANIFEST = "manifest.json"
+
+
+def column_kind(column) -> str:
+    """Map a SQLAlchemy column to the storage kind used for its array."""
+    if isinstance(column.type, Boolean):
+        return "bool"
+    if isinstance(column.type, Integer):
+        return "int"
+    if isinstance(column.type, Float):
+        return "float"
+    return "str"
+
+
+# Every column of the row table, in declaration order, with its storage kind
+ROW_COLUMNS: Dict[str, str] = {column.key: column_kind(column) for column in Row.__table__.columns}
+
+
+class StringColumn:
+    """Dictionary-encoded string column: int32 codes into a list of distinct values (-1 is NULL)."""
+
+    kind = "str"
+
+    def __init__(self, codes: np.ndarray, dictionary: List[str]):
+        self.codes = codes
+        self.dictionary = dictionary
+        self._nbytes = None
+
+    @classmethod
+    def encode(cls, values: Iterable[Optional[str]]) -> "StringColumn":
+        index: Dict[str, int] = {}
+        dictionary: List[str] = []
+        codes = []
+        for value in values:
+            if value is None:
+                codes.append(-1)
+                continue
+            code = index.get(value)
+            if code is None:
+                code = index[value] = len(dictionary)
+                dictionary.append(value)
+            codes.append(code)
+        return cls(np.asarray(codes, dtype=np.int32), dictionary)
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def nbytes(self) -> int:
+        # Count the Python objects behind the dictionary, not just its characters: a short str costs ~50 bytes
+        if self._nbytes is None:
+            self._nbytes = sys.getsizeof(self.dictionary) + sum(sys.getsizeof(value) for value in self.dictionary)
+        return self.codes.nbytes + self._nbytes
+
+    def value(self, i: int) -> Optional[str]:
+        code = int(self.codes[i])
+        return None if code < 0 else self.dictionary[code]
+
+    def isin(self, values: Sequence) -> np.ndarray:
+        values = set(values)
+        wanted = [i for i, value in enumerate(self.dictionary) if value in values]
+        return np.isin(self.codes, np.asarray(wanted, dtype=np.int32))
+
+    def counts(self, weights: Optional[np.ndarray] = None) -> Tuple[list, np.ndarray]:
+        valid = self.codes >= 0
+        counts = np.bincount(
+            self.codes[valid],
+            weights=None if weights is None else weights[valid],
+            minlength=len(self.dictionary),
+        )
+        return self.dictionary, counts
+
+
+class NumericColumn:
+    """Fixed-width numeric column (int64 with INT_NULL sentinel, float64 with NaN, bool stored as int64)."""
+
+    def __init__(self, values: np.ndarray, kind: str):
+        self.values = values
+        self.kind = kind
+
+    @classmethod
+    def encode(cls, values: Iterable, kind: str) -> "NumericColumn":
+        if kind == "float":
+            array = np.asarray([np.nan if v is None else v for v in values], dtype=np.float64)
+        else:
+            array = np.asarray([INT_NULL if v is None else int(v) for v in values], dtype=np.int64)
+        return cls(array, kind)
+
+    def __len__(self):
+        return len(self.values)
+
+    @property
+    def nbytes(self) -> int:
+        return self.values.nbytes
+
+    @property
+    def valid(self) -> np.ndarray:
+        if self.kind == "float":
+            return ~np.isnan(self.values)
+        return self.values != INT_NULL
+
+    def value(self, i: int):
+        raw = self.values[i]
+        if self.kind == "float":
+            return None if np.isnan(raw) else float(raw)
+        if raw == INT_NULL:
+            return None
+        return bool(raw) if self.kind == "bool" else int(raw)
+
+    def isin(self, values: Sequence) -> np.ndarray:
+        return np.isin(self.values, np.asarray(list(values), dtype=self.values.dtype))
+
+    def counts(self, weights: Optional[np.ndarray] = None) -> Tuple[list, np.ndarray]:
+        valid = self.valid
+        uniques, inverse = np.unique(self.values[valid], return_inverse=True)
+        counts = np.bincount(
+            inverse,
+            weights=None if weights is None else weights[valid],
+            minlength=len(uniques),
+        )
+        keys = [bool(u) if self.kind == "bool" else u.item() for u in uniques]
+        return keys, counts
+
+
+class ColumnBatch:
+    """A set of equally long encoded columns holding the rows of one log."""
+
+    def __init__(self, columns: Dict[str, object], n_rows: int):
+        self.columns = columns
+        self.n_rows = n_rows
+        self._weights = None
+        self._weights_loaded = False
+
+    @classmethod
+    def from_records(cls, names: Sequence[str], records: Sequence[Sequence]) -> "ColumnBatch":
+        columns = {}
+        for position, name in enumerate(names):
+            kind = ROW_COLUMNS.get(name, "str")
+            values = [record[position] for record in records]
+            if kind == "str":
+                columns[name] = StringColumn.encode(values)
+            else:
+                columns[name] = NumericColumn.encode(values, kind)
+        return cls(columns, len(records))
+
+    @property
+    def nbytes(self) -> int:
+        return sum(column.nbytes for column in self.columns.values())
+
+    def column(self, name: str):
+        if name not in self.columns:
+            raise KeyError(f"Unknown column: {name}")
+        return self.columns[name]
+
+    @property
+    def weights(self) -> Optional[np.ndarray]:
+        """Per-row weights of a sampled log, or None when every row counts once."""
+        if not self._weights_loaded:
+            column = self.columns.get("weight")
+            if column is not None:
+                values = np.where(column.valid, column.values, 1.0)
+                if not np.all(values == 1.0):
+                    self._weights = values
+            self._weights_loaded = True
+        return self._weights
+
+    def top_n(self, name: str, n: int = 5) -> List[Tuple[object, int]]:
+        keys, counts = self.column(name).counts(self.weights)
+        order = np.argsort(-counts, kind="stable")[:n]
+        return [(keys[i], int(round(counts[i]))) for i in order if counts[i] > 0]
+
+    def rows(self, indices: Optional[Iterable[int]] = None) -> List[dict]:
+        if indices is None:
+            indices = range(self.n_rows)
+        return [
+            {name: column.value(int(i)) for name, column in self.columns.items()}
+            for i in indices
+        ]
+
+
+def null_column(kind: str, n_rows: int):
+    """A column of n_rows NULLs of the given storage kind."""
+    if kind == "str":
+        return StringColumn(np.full(n_rows, -1, dtype=np.int32), [])
+    if kind == "float":
+        return NumericColumn(np.full(n_rows, np.nan), kind)
+    return NumericColumn(np.full(n_rows, INT_NULL, dtype=np.int64), kind)
+
+
+def write_batch(batch: ColumnBatch, directory: str) -> None:
+    """Persist a batch as one .npy file per array plus a JSON manifest, replacing any previous copy."""
+    # A private staging directory per writer, so concurrent writers never share partial files
+    parent = os.path.dirname(os.path.abspath(directory))
+    os.makedirs(parent, exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix=os.path.basename(directory) + ".tmp-", dir=parent)
+    try:
+        manifest = {"n_rows": batch.n_rows, "columns": {}}
+        for name, column in batch.columns.items():
+            manifest["columns"][name] = column.kind
+            if column.kind == "str":
+                np.save(os.path.join(tmp, f"{name}.codes.npy"), column.codes)
+                with open(os.path.join(tmp, f"{name}.dict.json"), "w", encoding="utf-8") as f:
+                    json.dump(column.dictionary, f)
+            else:
+                np.save(os.path.join(tmp, f"{name}.npy"), column.values)
+        with open(os.path.join(tmp, MANIFEST), "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        shutil.rmtree(directory, ignore_errors=True)
+        os.replace(tmp, directory)
+    except Exception:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+
+def open_batch(directory: str) -> ColumnBatch:
+    """Open a batch written by write_batch with its arrays memory-mapped read-only."""
+    with open(os.path.join(directory, MANIFEST), encoding="utf-8") as f:
+        manifest = json.load(f)
+    columns = {}
+    for name, kind in manifest["columns"].items():
+        if kind == "str":
+            codes = np.load(os.path.join(directory, f"{name}.codes.npy"), mmap_mode="r")
+            with open(os.path.join(directory, f"{name}.dict.json"), encoding="utf-8") as f:
+                dictionary = json.load(f)
+            columns[name] = StringColumn(codes, dictionary)
+        else:
+            values = np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+            columns[name] = NumericColumn(values, kind)
+    # Archives written before a column was added to Row read it as all NULL, except enrichment columns,
+    # which are derived from the stored user agents, URLs and timestamps
+    missing = [name for name in ROW_COLUMNS if name not in columns]
+    if any(name in ENRICHED_FIELDS for name in missing):
+        columns.update({name: column for name, column in derive_enrichment(columns).items() if name in missing})
+    for name in missing:
+        if name not in columns:
+            columns[name] = null_column(ROW_COLUMNS[name], manifest["n_rows"])
+    return ColumnBatch(columns, manifest["n_rows"])
+
+
+def derive_enrichment(columns: Dict[str, object]) -> Dict[str, object]:
+    """Enrichment columns computed from the dictionaries of a batch's raw columns, once per distinct value."""
+    sources = ("user_agent", "url", "timestamp")
+    if not all(isinstance(columns.get(name), StringColumn) for name in sources):
+        return {}
+    derived = {}
+    for source, names in (("user_agent", ("browser", "os", "agent_type")), ("url", ("route",)), ("timestamp", ("epoch",))):
+        column = columns[source]
+        per_value = [derived_fields(**{source: value}) for value in column.dictionary]
+        for name in names:
+            values = [fields[name] for fields in per_value]
+            if ROW_COLUMNS[name] == "str":
+                encoded = StringColumn.encode(values)
+                lookup = np.append(encoded.codes, np.int32(-1))  # a NULL source stays NULL
+                derived[name] = StringColumn(lookup[np.asarray(column.codes)], encoded.dictionary)
+            else:
+                lookup = np.asarray([np.nan if value is None else value for value in values] + [np.nan], dtype=np.float64)
+                derived[name] = NumericColumn(lookup[np.asarray(column.codes)], ROW_COLUMNS[name])
+    return derived
@@ -0,0 +1,175 @@
+import logging
+import os
+import re
+from functools import lru_cache
+from typing import Optional, Set, Tuple
+
+from sqlalchemy import Table, select, text
+from sqlalchemy.engine import Connection
+
+from schemas.rowDTO import RowDTO
+from tools.parser import parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+# Distinct user agents and URLs remembered by the memoized classifiers
+UA_CACHE_SIZE = int(os.getenv("LASYS_ENRICH_UA_CACHE", "4096"))
+ROUTE_CACHE_SIZE = int(os.getenv("LASYS_ENRICH_ROUTE_CACHE", "65536"))
+# Rows read and updated per statement when enriching rows stored before the enrichment columns existed;
+# each takes a bound parameter per enriched field, which must stay under SQLite's 32766 limit
+BACKFILL_BATCH_ROWS = 2_000
+
+# Row columns filled by enrich(); they are derived, never taken from the input
+ENRICHED_FIELDS = ("browser", "os", "agent_type", "route", "epoch")
+
+BOT_PATTERN = re.compile(
+    r"bot|crawl|spider|slurp|scrapy|headless|monitor|pingdom|curl/|wget/|python-requests|"
+    r"go-http-client|java/|libwww|httpclient|okhttp",
+    re.IGNORECASE,
+)
+
+# First matching rule wins, so more specific tokens come before the ones they embed (Edge and Opera send "Chrome/")
+BROWSER_RULES = [(name, re.compile(pattern)) for name, pattern in [
+    ("Edge", r"Edg(e|A|iOS)?/"),
+    ("Opera", r"OPR/|Opera"),
+    ("Samsung Internet", r"SamsungBrowser/"),
+    ("Chrome", r"Chrome/|CriOS/"),
+    ("Firefox", r"Firefox/|FxiOS/"),
+    ("Safari", r"Version/[\d.]+.*Safari/"),
+    ("Internet Explorer", r"MSIE |Trident/"),
+]]
+
+OS_RULES = [(name, re.compile(pattern)) for name, pattern in [
+    ("Windows", r"Windows"),
+    ("iOS", r"iPhone|iPad|iPod"),
+    ("Android", r"Android"),
+    ("macOS", r"Mac OS X|Macintosh"),
+    ("ChromeOS", r"CrOS"),
+    ("Linux", r"Linux|X11"),
+]]
+
+# Path segments replaced by a placeholder when building the route template, checked in order
+SEGMENT_RULES = [(placeholder, re.compile(pattern)) for placeholder, pattern in [
+    ("{uuid}", r"^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$"),
+    ("{id}", r"^\d+$"),
+    ("{hash}", r"^(?=[^/]*\d)[0-9a-fA-F]{16,}$"),
+]]
+
+
+def _first_match(rules, value: str) -> str:
+    for name, pattern in rules:
+        if pattern.search(value):
+            return name
+    return "Other"
+
+
+@lru_cache(maxsize=UA_CACHE_SIZE)
+def classify_user_agent(user_agent: Optional[str]) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+    """Return (browser, os, agent_type) for a raw User-Agent header; agent_type is "bot" or "human"."""
+    if not user_agent or user_agent == "-":
+        return None, None, None
+    agent_type = "bot" if BOT_PATTERN.search(user_agent) else "human"
+    return _first_match(BROWSER_RULES, user_agent), _first_match(OS_RULES, user_agent), agent_type
+
+
+@lru_cache(maxsize=ROUTE_CACHE_SIZE)
+def url_route(url: Optional[str]) -> Optional[str]:
+    """Template a request URL by dropping the query string and replacing id-like segments (/items/123 -> /items/{id})."""
+    if not url:
+        return None
+    path = url.split("?", 1)[0].split("#", 1)[0]
+    segments = path.split("/")
+    for i, segment in enumerate(segments):
+        for placeholder, pattern in SEGMENT_RULES:
+            if pattern.match(segment):
+                segments[i] = placeholder
+                break
+    return "/".join(segments)
+
+
+def enrich(row: RowDTO) -> RowDTO:
+    """Fill the derived browser, os, agent_type, route and epoch fields of a parsed row in place."""
+    # Write the fields directly: pydantic's validating __setattr__ would cost more than the cached lookups
+    fields = row.__dict__
+    if row.user_agent is not None:
+        fields["browser"], fields["os"], fields["agent_type"] = classify_user_agent(row.user_agent)
+    if row.url is not None:
+        fields["route"] = url_route(row.url)
+    if row.timestamp is not None:
+        fields["epoch"] = parse_timestamp(row.timestamp)
+    return row
+
+
+def derived_fields(user_agent: Optional[str] = None, url: Optional[str] = None, timestamp: Optional[str] = None) -> dict:
+    """All enriched fields of a row from its raw user agent, URL and timestamp."""
+    browser, os_name, agent_type = classify_user_agent(user_agent)
+    return {
+        "browser": browser,
+        "os": os_name,
+        "agent_type": agent_type,
+        "route": url_route(url),
+        "epoch": parse_timestamp(timestamp),
+    }
+
+
+def backfill_enrichment(connection: Connection, table: Table, added: Set[str]) -> None:
+    """Schema upgrade hook: derive enrichment columns just added to an existing row table for the rows it holds.
+
+    Without it every log stored before an upgrade answers [] from /topbrowsers, /toproutes and the like.
+    Rows are walked in primary key order, and each chunk is written back with a single UPDATE ... FROM a VALUES list.
+    """
+    fields = [name for name in ENRICHED_FIELDS if name in added]
+    if table.name != "row" or not fields:
+        return
+    columns = table.c
+    dialect = connection.dialect
+    target = dialect.identifier_preparer.format_table(table)
+    names = ["row_id", *fields]
+    # Cast so a VALUES column holding only NULLs is not typed as text (PostgreSQL)
+    assignments = ", ".join(
+        f"{dialect.identifier_preparer.quote(name)} = CAST(derived.{name} AS {columns[name].type.compile(dialect=dialect)})"
+        for name in fields
+    )
+
+    def statement(n_rows: int) -> str:
+        # A CTE rather than (VALUES ...) AS derived (...): SQLite does not accept column names on a VALUES alias
+        rows = ", ".join("(" + ", ".join(f":v{i}_{j}" for j in range(len(names))) + ")" for i in range(n_rows))
+        return (f"WITH derived ({', '.join(names)}) AS (VALUES {rows}) "
+                f"UPDATE {target} SET {assignments} FROM derived WHERE {target}.id = derived.row_id")
+
+    last_id, updated = None, 0
+    while True:
+        query = select(columns.id, columns.user_agent, columns.url, columns.timestamp) \
+            .order_by(columns.id).limit(BACKFILL_BATCH_ROWS)
+        if last_id is not None:
+            query = query.where(columns.id > last_id)
+        chunk = connection.execute(query).all()
+        if not chunk:
+            break
+        rows = []
+        for row_id, user_agent, url, timestamp in chunk:
+            derived = derived_fields(user_agent, url, timestamp)
+            if any(derived[name] is not None for name in fields):
+                rows.append((row_id, *(derived[name] for name in fields)))
+        if rows:
+            connection.execute(text(statement(len(rows))), {
+                f"v{i}_{j}": value for i, row in enumerate(rows) for j, value in enumerate(row)
+            })
+            updated += len(rows)
+        last_id = chunk[-1][0]
+    logger.warning(f"Upgrading schema: derived {', '.join(fields)} for {updated} existing rows")
+
+
+def cache_stats() -> dict:
+    """Hit rates of the memoized classifiers since startup."""
+    stats = {}
+    for name, fn in (("user_agent", classify_user_agent), ("route", url_route)):
+        info = fn.cache_info()
+        lookups = info.hits + info.misses
+        stats[name] = {
+            "hits": info.hits,
+            "misses": info.misses,
+            "size": info.currsize,
+            "hit_rate": info.hits / lookups if lookups else None,
+        }
+    return stats
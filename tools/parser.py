@@ -1,186 +1,328 @@
+import io
+import os
+import random
 import re
-from typing import List
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from functools import lru_cache
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Pattern, Tuple
 from fastapi import HTTPException
 from schemas.rowDTO import RowDTO
 import logging
 
 logger = logging.getLogger(__name__)
 
-def parse_apache_log(contents: str) -> List[RowDTO]:
-    rows = []
-    
-    # Updated regex pattern to capture remote_logname, user, and protocol_version
-    log_pattern = (r'(?P<ip>\S+) (?P<remote_logname>\S+) (?P<user>\S+) \[(?P<timestamp>.*?)\] '
-                   r'"(?P<method>\S+) (?P<url>\S+) HTTP/(?P<protocol_version>\S+)" (?P<status_code>\d+) '
-                   r'(?P<response_size>(\d+|-)) "(?P<referrer>.*?)" "(?P<user_agent>.*?)"')
-
-    for line in contents.splitlines():
-        match = re.match(log_pattern, line)
-        
-        if match:
-            log_data = match.groupdict()
-            
-            # Handle status code properly, defaulting to 0 if not found
-            if 'status_code' in log_data and log_data['status_code']:
-                logger.debug(f"status_code: {log_data['status_code']}")
-                status_code = int(log_data['status_code'])
-            else:
-                status_code = 0  # Default value if status code is not found
-            
-            # Handle response size, defaulting to 0 if it is "-"
-            response_size = int(log_data['response_size']) if log_data['response_size'] != "-" else 0
-            
-            try:
-                # Creating RowDTO object with all the necessary fields
-                row_dto = RowDTO(
-                    ip=log_data['ip'],
-                    timestamp=log_data['timestamp'],
-                    method=log_data['method'],
-                    url=log_data['url'],
-                    status=status_code,
-                    response_size=response_size,
-                    referer=log_data['referrer'],
-                    user_agent=log_data['user_agent'],
-                    remote_logname=log_data['remote_logname'],
-                    user=log_data['user'],
-                    protocol="HTTP/"+log_data['protocol_version']
-                )
-                rows.append(row_dto)
-            except Exception as e:
-                logger.warning(f"Skipping invalid log line: {line} due to error: {e}")
-        else:
-            logger.warning(f"Skipping unparsable log line: {line}")
-    
-    if not rows:
-        raise HTTPException(status_code=400, detail="No valid log entries found in the file.")
-    
-    return rows
+# Bad lines kept per parse report, and how much of each line is kept
+PARSE_SAMPLE_SIZE = int(os.getenv("LASYS_PARSE_SAMPLE_SIZE", "20"))
+PARSE_SAMPLE_CHARS = 512
+# Minimum interval between two parse summaries written to the application log
+PARSE_SUMMARY_SECONDS = float(os.getenv("LASYS_PARSE_SUMMARY_SECONDS", "10"))
+# Format sniffing looks at this much of an upload, and at most this many of its lines
+SNIFF_BYTES = int(os.getenv("LASYS_SNIFF_KB", "64")) * 1024
+SNIFF_MAX_LINES = 200
+# Share of the sniffed lines a format must match to be chosen
+SNIFF_MIN_SCORE = float(os.getenv("LASYS_SNIFF_MIN_SCORE", "0.5"))
 
-def parse_apache_error_log(contents: str) -> List[RowDTO]:
-    rows = []
-    
-    # Regex pattern to capture Apache error log fields: timestamp, log level, client IP, and error message
-    log_pattern = (r'^\[(?P<timestamp>.*?)\] \[(?P<log_level>\S+)\] '
-                   r'\[pid \d+:tid \d+\] \[client (?P<ip>\S+):\d+\] (?P<message>.*?)$')
-
-    for line in contents.splitlines():
-        match = re.match(log_pattern, line)
-        
-        if match:
-            log_data = match.groupdict()
-            
-            # Handle default values for missing fields
-            log_level = log_data.get('log_level', 'UNKNOWN')
-            message = log_data.get('message', 'No message provided')
-
-            try:
-                # Creating RowDTO object with all the necessary fields
-                row_dto = RowDTO(
-                    ip=log_data['ip'],
-                    timestamp=log_data['timestamp'],
-                    message=message,
-                    level=log_level,
-                    component="Apache"  # Assuming the source of the log is Apache
-                )
-                rows.append(row_dto)
-            except Exception as e:
-                logger.warning(f"Skipping invalid log line: {line} due to error: {e}")
-        else:
-            logger.warning(f"Skipping unparsable log line: {line}")
-    
-    if not rows:
-        raise Exception("No valid log entries found in the file.")
-    
-    return rows
+# Timestamp layouts written by the supported access and error log formats
+TIMESTAMP_FORMATS = [
+    "%d/%b/%Y:%H:%M:%S %z",     # Apache/NGINX access logs
+    "%a %b %d %H:%M:%S.%f %Y",  # Apache error logs
+    "%a %b %d %H:%M:%S %Y",
+    "%Y/%m/%d %H:%M:%S",        # NGINX error logs
+]
+
+@lru_cache(maxsize=4096)
+def parse_timestamp(value: Optional[str]) -> Optional[float]:
+    """Convert a raw log timestamp to epoch seconds, or None if it matches no known layout."""
+    if not value:
+        return None
+    for fmt in TIMESTAMP_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).timestamp()
+        except ValueError:
+            continue
+    return None
+
+class ParseReport:
+    """Bounded diagnostics for one parse: counts per rejection reason plus a reservoir sample of bad lines.
 
-def parse_nginx_log(contents: str) -> List[RowDTO]:
-    rows = []
-    
-    # Regex pattern for the default NGINX combined log format
-    log_pattern = (r'(?P<ip>\S+) - (?P<remote_user>\S+) \[(?P<timestamp>.*?)\] '
-                   r'"(?P<method>\S+) (?P<url>\S+) (?P<protocol>HTTP/\S+)" (?P<status_code>\d+) '
-                   r'(?P<response_size>(\d+|-)) "(?P<referer>.*?)" "(?P<user_agent>.*?)"')
-
-    for line in contents.splitlines():
-        match = re.match(log_pattern, line)
-        
-        if match:
-            log_data = match.groupdict()
-            
-            # Handle status code properly, defaulting to 0 if not found
-            if 'status_code' in log_data and log_data['status_code']:
-                logger.debug(f"status_code: {log_data['status_code']}")
-                status_code = int(log_data['status_code'])
-            else:
-                status_code = 0  # Default value if status code is not found
-            
-            # Handle response size, defaulting to 0 if it is "-"
-            response_size = int(log_data['response_size']) if log_data['response_size'] != "-" else 0
-            
-            try:
-                # Creating RowDTO object with all the necessary fields
-                row_dto = RowDTO(
-                    ip=log_data['ip'],
-                    timestamp=log_data['timestamp'],
-                    method=log_data['method'],
-                    url=log_data['url'],
-                    status=status_code,
-                    response_size=response_size,
-                    referer=log_data['referer'],
-                    user_agent=log_data['user_agent'],
-                    protocol=log_data['protocol'],
-                    remote_logname=log_data['remote_user']
-                )
-                rows.append(row_dto)
-            except Exception as e:
-                logger.warning(f"Skipping invalid log line: {line} due to error: {e}")
+    Memory stays constant however many lines are rejected, so a file in the wrong format costs a counter
+    increment per line instead of a formatted log record.
+    """
+
+    def __init__(self, sample_size: int = PARSE_SAMPLE_SIZE):
+        self.sample_size = sample_size
+        self.lines = 0
+        self.accepted = 0
+        self.reasons = Counter()
+        self.warnings = Counter()
+        self.sample = []
+        self._random = random.Random()
+
+    @property
+    def rejected(self) -> int:
+        return sum(self.reasons.values())
+
+    def accept(self):
+        self.accepted += 1
+
+    def reject(self, line_number: int, line: str, reason: str):
+        self.reasons[reason] += 1
+        entry = {"line": line_number, "reason": reason, "text": line[:PARSE_SAMPLE_CHARS]}
+        # Reservoir sampling (algorithm R): every rejected line has the same chance of being kept
+        seen = self.rejected
+        if len(self.sample) < self.sample_size:
+            self.sample.append(entry)
         else:
-            logger.warning(f"Skipping unparsable log line: {line}")
-    
-    if not rows:
-        raise HTTPException(status_code=400, detail="No valid log entries found in the file.")
-    
+            slot = self._random.randrange(seen)
+            if slot < self.sample_size:
+                self.sample[slot] = entry
+
+    def warn(self, reason: str):
+        """Count a suspicious line that was still accepted."""
+        self.warnings[reason] += 1
+
+    def summary(self) -> str:
+        reasons = ", ".join(f"{reason}={count}" for reason, count in self.reasons.most_common())
+        return f"{self.lines} lines, {self.accepted} accepted, {self.rejected} rejected" + (f" ({reasons})" if reasons else "")
+
+    def to_dict(self) -> dict:
+        return {
+            "lines": self.lines,
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "reasons": dict(self.reasons),
+            "warnings": dict(self.warnings),
+            "sample": sorted(self.sample, key=lambda entry: entry["line"]),
+        }
+
+
+class SummaryLimiter:
+    """Let at most one parse summary through per interval and count the ones held back."""
+
+    def __init__(self, interval: float = PARSE_SUMMARY_SECONDS):
+        self.interval = interval
+        self.suppressed = 0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def emit(self, report: ParseReport, parser: str):
+        if not report.rejected and not report.warnings:
+            return
+        with self._lock:
+            now = time.monotonic()
+            if now < self._next:
+                self.suppressed += 1
+                return
+            self._next = now + self.interval
+            suppressed, self.suppressed = self.suppressed, 0
+        logger.warning(
+            f"{parser}: {report.summary()}"
+            + (f"; {suppressed} similar summaries suppressed" if suppressed else "")
+        )
+
+summary_limiter = SummaryLimiter()
+
+def finish_parse(rows: List[RowDTO], report: ParseReport, parser: str) -> List[RowDTO]:
+    """Log the rate-limited summary and reject files without a single valid entry."""
+    summary_limiter.emit(report, parser)
+    if not report.accepted:
+        raise HTTPException(status_code=400, detail=f"No valid log entries found in the file: {report.summary()}")
     return rows
 
-def parse_nginx_error_log(contents: str) -> List[RowDTO]:
-    rows = []
-    
-    # Regex pattern to capture Nginx error log fields: timestamp, log level, PID/TID, client IP, message, request, host, server
-    log_pattern = (r'(?P<timestamp>\d{4}/\d{2}/\d{2} \d{2}:\d{2}:\d{2}) '
-                   r'\[(?P<log_level>\S+)\] (?P<pid_tid>\d+#\d+): '
-                   r'\*(?P<client_ip>\d+\.\d+\.\d+\.\d+) (?P<message>.*?), '
-                   r'client: (?P<client_ip2>\d+\.\d+\.\d+\.\d+), server: (?P<server>\S+), '
-                   r'request: "(?P<request>.*?)", host: "(?P<host>.*?)"')
-
-    for line in contents.splitlines():
-        match = re.match(log_pattern, line)
-        
-        if match:
-            log_data = match.groupdict()
-            
-            # Check that the IPs are the same (from client_ip and client_ip2)
-            if log_data['client_ip'] != log_data['client_ip2']:
-                logger.warning(f"IP mismatch found: {log_data['client_ip']} != {log_data['client_ip2']}")
-
-            try:
-                # Creating RowDTO object with all the necessary fields
-                row_dto = RowDTO(
-                    timestamp=log_data['timestamp'],
-                    level=log_data['log_level'],
-                    pid_tid=log_data['pid_tid'],
-                    ip=log_data['client_ip'],
-                    message=log_data['message'],
-                    request=log_data['request'],
-                    host=log_data['host'],
-                    server=log_data['server']
-                )
-                rows.append(row_dto)
-            except Exception as e:
-                logger.warning(f"Skipping invalid log line: {line} due to error: {e}")
-        else:
-            logger.warning(f"Skipping unparsable log line: {line}")
-    
-    if not rows:
-        raise Exception("No valid log entries found in the file.")
-    
-    return rows
\ No newline at end of file
+# Updated regex pattern to capture remote_logname, user, and protocol_version
+APACHE_PATTERN = re.compile(
+    r'(?P<ip>\S+) (?P<remote_logname>\S+) (?P<user>\S+) \[(?P<timestamp>.*?)\] '
+    r'"(?P<method>\S+) (?P<url>\S+) HTTP/(?P<protocol_version>\S+)" (?P<status_code>\d+) '
+    r'(?P<response_size>(\d+|-)) "(?P<referrer>.*?)" "(?P<user_agent>.*?)"'
+)
+
+def apache_fields(log_data: dict, report: ParseReport) -> dict:
+    # Handle status code properly, defaulting to 0 if not found
+    if 'status_code' in log_data and log_data['status_code']:
+        status_code = int(log_data['status_code'])
+    else:
+        status_code = 0  # Default value if status code is not found
+
+    # Handle response size, defaulting to 0 if it is "-"
+    response_size = int(log_data['response_size']) if log_data['response_size'] != "-" else 0
+
+    return dict(
+        ip=log_data['ip'],
+        timestamp=log_data['timestamp'],
+        method=log_data['method'],
+        url=log_data['url'],
+        status=status_code,
+        response_size=response_size,
+        referer=log_data['referrer'],
+        user_agent=log_data['user_agent'],
+        remote_logname=log_data['remote_logname'],
+        user=log_data['user'],
+        protocol="HTTP/"+log_data['protocol_version']
+    )
+
+def parse_apache_log(contents: str, report: Optional[ParseReport] = None) -> List[RowDTO]:
+    return parse_lines(contents.splitlines(), "apache", report)
+
+# Regex pattern to capture Apache error log fields: timestamp, log level, client IP, and error message
+APACHE_ERROR_PATTERN = re.compile(
+    r'^\[(?P<timestamp>.*?)\] \[(?P<log_level>\S+)\] '
+    r'\[pid \d+:tid \d+\] \[client (?P<ip>\S+):\d+\] (?P<message>.*?)$'
+)
+
+def apache_error_fields(log_data: dict, report: ParseReport) -> dict:
+    # Handle default values for missing fields
+    log_level = log_data.get('log_level', 'UNKNOWN')
+    message = log_data.get('message', 'No message provided')
+
+    return dict(
+        ip=log_data['ip'],
+        timestamp=log_data['timestamp'],
+        message=message,
+        level=log_level,
+        component="Apache"  # Assuming the source of the log is Apache
+    )
+
+def parse_apache_error_log(contents: str, report: Optional[ParseReport] = None) -> List[RowDTO]:
+    return parse_lines(contents.splitlines(), "apache_error", report)
+
+# Regex pattern for the default NGINX combined log format
+NGINX_PATTERN = re.compile(
+    r'(?P<ip>\S+) - (?P<remote_user>\S+) \[(?P<timestamp>.*?)\] '
+    r'"(?P<method>\S+) (?P<url>\S+) (?P<protocol>HTTP/\S+)" (?P<status_code>\d+) '
+    r'(?P<response_size>(\d+|-)) "(?P<referer>.*?)" "(?P<user_agent>.*?)"'
+)
+
+def nginx_fields(log_data: dict, report: ParseReport) -> dict:
+    # Handle status code properly, defaulting to 0 if not found
+    if 'status_code' in log_data and log_data['status_code']:
+        status_code = int(log_data['status_code'])
+    else:
+        status_code = 0  # Default value if status code is not found
+
+    # Handle response size, defaulting to 0 if it is "-"
+    response_size = int(log_data['response_size']) if log_data['response_size'] != "-" else 0
+
+    return dict(
+        ip=log_data['ip'],
+        timestamp=log_data['timestamp'],
+        method=log_data['method'],
+        url=log_data['url'],
+        status=status_code,
+        response_size=response_size,
+        referer=log_data['referer'],
+        user_agent=log_data['user_agent'],
+        protocol=log_data['protocol'],
+        remote_logname=log_data['remote_user']
+    )
+
+def parse_nginx_log(contents: str, report: Optional[ParseReport] = None) -> List[RowDTO]:
+    return parse_lines(contents.splitlines(), "nginx", report)
+
+# Regex pattern to capture Nginx error log fields: timestamp, log level, PID/TID, client IP, message, request, host, server
+NGINX_ERROR_PATTERN = re.compile(
+    r'(?P<timestamp>\d{4}/\d{2}/\d{2} \d{2}:\d{2}:\d{2}) '
+    r'\[(?P<log_level>\S+)\] (?P<pid_tid>\d+#\d+): '
+    r'\*(?P<client_ip>\d+\.\d+\.\d+\.\d+) (?P<message>.*?), '
+    r'client: (?P<client_ip2>\d+\.\d+\.\d+\.\d+), server: (?P<server>\S+), '
+    r'request: "(?P<request>.*?)", host: "(?P<host>.*?)"'
+)
+
+def nginx_error_fields(log_data: dict, report: ParseReport) -> dict:
+    # Check that the IPs are the same (from client_ip and client_ip2)
+    if log_data['client_ip'] != log_data['client_ip2']:
+        report.warn("ip_mismatch")
+
+    return dict(
+        timestamp=log_data['timestamp'],
+        level=log_data['log_level'],
+        pid_tid=log_data['pid_tid'],
+        ip=log_data['client_ip'],
+        message=log_data['message'],
+        request=log_data['request'],
+        host=log_data['host'],
+        server=log_data['server']
+    )
+
+def parse_nginx_error_log(contents: str, report: Optional[ParseReport] = None) -> List[RowDTO]:
+    return parse_lines(contents.splitlines(), "nginx_error", report)
+
+class LogFormat(NamedTuple):
+    pattern: Pattern
+    fields: Callable[[dict, ParseReport], dict]  # named groups of a matching line -> RowDTO fields
+
+# Registered upload formats; the key is what Log.file_type records.
+# Order breaks ties: combined-format lines match both access log patterns and are filed as "apache".
+FORMATS: Dict[str, LogFormat] = {
+    "apache": LogFormat(APACHE_PATTERN, apache_fields),
+    "nginx": LogFormat(NGINX_PATTERN, nginx_fields),
+    "apache_error": LogFormat(APACHE_ERROR_PATTERN, apache_error_fields),
+    "nginx_error": LogFormat(NGINX_ERROR_PATTERN, nginx_error_fields),
+}
+
+class Entry(NamedTuple):
+    line_number: int
+    line: str
+    fields: dict
+
+def iter_entries(lines: Iterable[str], log_format: str, report: ParseReport) -> Iterator[Entry]:
+    """Match lines one at a time and yield the RowDTO fields of each, counting unparsable lines in the report.
+
+    Nothing is validated or accepted yet, so a caller can look at the fields and skip building a row; it then
+    settles every entry with report.accept() or to_row().
+    """
+    pattern, fields = FORMATS[log_format]
+    for line_number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        report.lines += 1
+        match = pattern.match(line)
+        if match is None:
+            report.reject(line_number, line, "unparsable")
+            continue
+        yield Entry(line_number, line, fields(match.groupdict(), report))
+
+def to_row(entry: Entry, report: ParseReport) -> Optional[RowDTO]:
+    """Validate an entry into a RowDTO, or record it as rejected and return None."""
+    try:
+        row = RowDTO(**entry.fields)
+    except Exception:
+        report.reject(entry.line_number, entry.line, "invalid")
+        return None
+    report.accept()
+    return row
+
+def read_lines(file: BinaryIO) -> Iterator[str]:
+    """Decode an uploaded file one line at a time instead of reading it whole; CRLF and CR endings are normalized."""
+    text = io.TextIOWrapper(file, encoding="utf-8", newline=None)
+    try:
+        for line in text:
+            yield line.rstrip("\n")
+    finally:
+        text.detach()  # Leave the upload's file open for whoever owns it
+
+def parse_lines(lines: Iterable[str], log_format: str, report: Optional[ParseReport] = None) -> List[RowDTO]:
+    report = report if report is not None else ParseReport()
+    rows = [row for row in (to_row(entry, report) for entry in iter_entries(lines, log_format, report)) if row is not None]
+    return finish_parse(rows, report, log_format)
+
+def sniff_format(prefix: str, truncated: bool = False) -> Tuple[Optional[str], dict]:
+    """Score every registered format on the leading lines of an upload.
+
+    Returns the best format (or None if none reaches SNIFF_MIN_SCORE) and a diagnosis with the
+    per-format share of matching lines. Pass truncated=True when the prefix was cut mid-file so
+    the last, possibly partial, line is ignored.
+    """
+    lines = prefix.splitlines()
+    if truncated and len(lines) > 1:
+        lines.pop()
+    lines = [line for line in lines if line.strip()][:SNIFF_MAX_LINES]
+    scores = {
+        name: (sum(1 for line in lines if log_format.pattern.match(line)) / len(lines) if lines else 0.0)
+        for name, log_format in FORMATS.items()
+    }
+    best = max(scores, key=scores.get)  # first registered format wins ties
+    diagnosis = {"lines_examined": len(lines), "scores": {name: round(score, 3) for name, score in scores.items()}}
+    return (best if scores[best] >= SNIFF_MIN_SCORE else None), diagnosis
@@ -0,0 +1,71 @@
+import hashlib
+import os
+from collections import Counter
+from typing import List, Optional
+
+from schemas.rowDTO import RowDTO
+
+# Rows of each stratum (status code, or level for error logs) kept in full before the stratum counts as common
+SAMPLE_RARE_ROWS = int(os.getenv("LASYS_SAMPLE_RARE_ROWS", "1000"))
+
+SAMPLE_KEYS = ("line", "ip")
+
+
+class Sampler:
+    """Deterministic stratified sampler with measured rarity.
+
+    Rows are grouped into strata by status code, or by level for error logs. The first rare_rows rows of
+    each stratum are kept with weight 1, so a status or level that stays rare is stored in full. Past that,
+    a row is kept when the hash of its key falls under the rate and gets weight 1 / rate, so weighted counts
+    are unbiased estimates of the full log. A scanner flooding the log with 404s therefore shrinks like any
+    other common traffic. Sampling by "ip" keeps or drops every request of a client together once its
+    strata are common.
+    """
+
+    def __init__(self, rate: float, key: str = "line", rare_rows: int = SAMPLE_RARE_ROWS):
+        if not 0 < rate <= 1:
+            raise ValueError("Sample rate must be in (0, 1]")
+        if key not in SAMPLE_KEYS:
+            raise ValueError(f"Sample key must be one of {SAMPLE_KEYS}")
+        self.rate = rate
+        self.key = key
+        self.rare_rows = rare_rows
+        self.threshold = int(rate * (1 << 64))
+        self.seen = Counter()
+
+    @staticmethod
+    def stratum(row: RowDTO):
+        if row.status is not None:
+            return row.status
+        # Apache 2.4 writes levels as module:level, e.g. core:error
+        return row.level.rsplit(":", 1)[-1].lower() if row.level is not None else None
+
+    def _key(self, row: RowDTO) -> str:
+        if self.key == "ip":
+            return row.ip or ""
+        return " ".join(str(value) for value in (
+            row.ip, row.timestamp, row.method, row.url, row.status, row.response_size, row.user_agent, row.message
+        ))
+
+    def selected(self, row: RowDTO) -> bool:
+        digest = hashlib.blake2b(self._key(row).encode("utf-8", "replace"), digest_size=8).digest()
+        return int.from_bytes(digest, "big") < self.threshold
+
+    def weight(self, row: RowDTO) -> Optional[float]:
+        """Weight of a row if it is kept, or None to drop it; rows must be offered in file order, once each."""
+        stratum = self.stratum(row)
+        self.seen[stratum] += 1
+        if self.seen[stratum] <= self.rare_rows:
+            return 1.0
+        if self.selected(row):
+            return 1 / self.rate
+        return None
+
+    def sample(self, rows: List[RowDTO]) -> List[RowDTO]:
+        kept = []
+        for row in rows:
+            weight = self.weight(row)
+            if weight is not None:
+                row.weight = weight
+                kept.append(row)
+        return kept
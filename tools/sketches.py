@@ -0,0 +1,287 @@
+import base64
+import hashlib
+import heapq
+import math
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Sequence
+
+
+def _hash64(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8", "replace"), digest_size=8).digest(), "big")
+
+
+class HyperLogLog:
+    """Distinct counter using 2**p one-byte registers; relative standard error is 1.04 / sqrt(2**p)."""
+
+    def __init__(self, p: int = 12, registers: Optional[bytearray] = None):
+        self.p = p
+        self.m = 1 << p
+        self.registers = registers if registers is not None else bytearray(self.m)
+
+    def add(self, value: Optional[str]) -> None:
+        if value is None:
+            return
+        h = _hash64(value)
+        index = h >> (64 - self.p)
+        rest = h & ((1 << (64 - self.p)) - 1)
+        rank = (64 - self.p) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: "HyperLogLog") -> "HyperLogLog":
+        if other.p != self.p:
+            raise ValueError("Cannot merge HyperLogLogs of different precision")
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+        return self
+
+    @property
+    def relative_error(self) -> float:
+        return 1.04 / math.sqrt(self.m)
+
+    def count(self) -> int:
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        estimate = alpha * self.m * self.m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.m and zeros:
+            # Linear counting is more accurate for small cardinalities
+            estimate = self.m * math.log(self.m / zeros)
+        return int(round(estimate))
+
+    def to_dict(self) -> dict:
+        return {"p": self.p, "registers": base64.b64encode(bytes(self.registers)).decode("ascii")}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "HyperLogLog":
+        return cls(data["p"], bytearray(base64.b64decode(data["registers"])))
+
+
+class SpaceSaving:
+    """Heavy-hitter summary tracking at most k items; each count overestimates the true count by at most its error."""
+
+    def __init__(self, k: int = 64, counters: Optional[Dict[str, List[int]]] = None):
+        self.k = k
+        self.counters: Dict[str, List[int]] = counters if counters is not None else {}
+        # Lazy min-heap of (count, item); entries go stale when a count grows and are refreshed on eviction
+        self._heap: Optional[List[tuple]] = None
+
+    def add(self, value: Optional[str], count: int = 1) -> None:
+        if value is None:
+            return
+        counter = self.counters.get(value)
+        if counter is not None:
+            counter[0] += count
+        elif len(self.counters) < self.k:
+            self.counters[value] = [count, 0]
+            if self._heap is not None:
+                heapq.heappush(self._heap, (count, value))
+        else:
+            floor = self._evict()
+            self.counters[value] = [floor + count, floor]
+            heapq.heappush(self._heap, (floor + count, value))
+
+    def _evict(self) -> int:
+        """Remove the item with the smallest count and return that count."""
+        if self._heap is None:
+            self._heap = [(counter[0], item) for item, counter in self.counters.items()]
+            heapq.heapify(self._heap)
+        while True:
+            count, item = heapq.heappop(self._heap)
+            counter = self.counters.get(item)
+            if counter is None:
+                continue
+            if counter[0] == count:
+                del self.counters[item]
+                return count
+            heapq.heappush(self._heap, (counter[0], item))
+
+    def _floor(self) -> int:
+        if len(self.counters) < self.k:
+            return 0
+        return min(counter[0] for counter in self.counters.values())
+
+    def merge(self, other: "SpaceSaving") -> "SpaceSaving":
+        # Items missing from one summary may have occurred up to that summary's minimum count
+        floor, other_floor = self._floor(), other._floor()
+        merged: Dict[str, List[int]] = {}
+        for item in set(self.counters) | set(other.counters):
+            count, error = self.counters.get(item, [floor, floor])
+            other_count, other_error = other.counters.get(item, [other_floor, other_floor])
+            merged[item] = [count + other_count, error + other_error]
+        top = sorted(merged.items(), key=lambda entry: entry[1][0], reverse=True)[:self.k]
+        self.counters = dict(top)
+        self._heap = None
+        return self
+
+    def top(self, n: int = 10) -> List[dict]:
+        ranked = sorted(self.counters.items(), key=lambda entry: entry[1][0], reverse=True)[:n]
+        return [
+            {"value": item, "count": count, "min_count": count - error, "error": error}
+            for item, (count, error) in ranked
+        ]
+
+    def to_dict(self) -> dict:
+        return {"k": self.k, "counters": self.counters}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "SpaceSaving":
+        return cls(data["k"], {item: list(counter) for item, counter in data["counters"].items()})
+
+
+class TDigest:
+    """Merging t-digest for quantiles; centroids near the tails stay small so extreme quantiles are accurate."""
+
+    def __init__(self, compression: float = 100, centroids: Optional[List[List[float]]] = None):
+        self.compression = compression
+        self.centroids: List[List[float]] = centroids if centroids is not None else []
+        self._buffer: List[float] = []
+
+    @property
+    def count(self) -> float:
+        self._flush()
+        return sum(weight for _, weight in self.centroids)
+
+    def add(self, value: Optional[float]) -> None:
+        if value is None:
+            return
+        self._buffer.append(float(value))
+        if len(self._buffer) >= 10 * self.compression:
+            self._flush()
+
+    def _flush(self) -> None:
+        if self._buffer:
+            self._compress(self.centroids + [[value, 1.0] for value in self._buffer])
+            self._buffer = []
+
+    def _compress(self, points: List[List[float]]) -> None:
+        points.sort(key=lambda point: point[0])
+        total = sum(weight for _, weight in points)
+        compressed: List[List[float]] = []
+        seen = 0.0
+        for mean, weight in points:
+            if compressed:
+                last = compressed[-1]
+                q = (seen + (last[1] + weight) / 2) / total
+                limit = 4 * total * q * (1 - q) / self.compression
+                if last[1] + weight <= max(limit, 1.0):
+                    last[0] += (mean - last[0]) * weight / (last[1] + weight)
+                    last[1] += weight
+                    continue
+                seen += last[1]
+            compressed.append([mean, weight])
+        self.centroids = compressed
+
+    def merge(self, other: "TDigest") -> "TDigest":
+        self._flush()
+        other._flush()
+        self._compress(self.centroids + [list(centroid) for centroid in other.centroids])
+        return self
+
+    def quantile(self, q: float) -> Optional[float]:
+        self._flush()
+        if not self.centroids:
+            return None
+        if len(self.centroids) == 1:
+            return self.centroids[0][0]
+        total = sum(weight for _, weight in self.centroids)
+        target = q * total
+        # Cumulative weight up to the middle of each centroid
+        middles = []
+        seen = 0.0
+        for _, weight in self.centroids:
+            middles.append(seen + weight / 2)
+            seen += weight
+        i = bisect_left(middles, target)
+        if i == 0:
+            return self.centroids[0][0]
+        if i == len(middles):
+            return self.centroids[-1][0]
+        (left, _), (right, _) = self.centroids[i - 1], self.centroids[i]
+        fraction = (target - middles[i - 1]) / (middles[i] - middles[i - 1])
+        return left + (right - left) * fraction
+
+    def rank_error(self, q: float) -> float:
+        """Bound on the rank error at quantile q implied by the maximum centroid size there."""
+        return 2 * q * (1 - q) / self.compression
+
+    def to_dict(self) -> dict:
+        self._flush()
+        return {"compression": self.compression, "centroids": self.centroids}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "TDigest":
+        return cls(data["compression"], [list(centroid) for centroid in data["centroids"]])
+
+
+class LogSketches:
+    """The approximate statistics kept for every log, built in one pass over its rows."""
+
+    def __init__(self, rows: int = 0, distinct_ips=None, distinct_user_agents=None,
+                 heavy_urls=None, heavy_ips=None, response_size=None):
+        self.rows = rows
+        self.distinct_ips = distinct_ips or HyperLogLog()
+        self.distinct_user_agents = distinct_user_agents or HyperLogLog()
+        self.heavy_urls = heavy_urls or SpaceSaving()
+        self.heavy_ips = heavy_ips or SpaceSaving()
+        self.response_size = response_size or TDigest()
+
+    def add(self, row) -> None:
+        self.rows += 1
+        self.distinct_ips.add(row.ip)
+        self.distinct_user_agents.add(row.user_agent)
+        self.heavy_urls.add(row.url)
+        self.heavy_ips.add(row.ip)
+        self.response_size.add(row.response_size)
+
+    def update(self, rows: Iterable) -> "LogSketches":
+        for row in rows:
+            self.add(row)
+        return self
+
+    def merge(self, other: "LogSketches") -> "LogSketches":
+        self.rows += other.rows
+        self.distinct_ips.merge(other.distinct_ips)
+        self.distinct_user_agents.merge(other.distinct_user_agents)
+        self.heavy_urls.merge(other.heavy_urls)
+        self.heavy_ips.merge(other.heavy_ips)
+        self.response_size.merge(other.response_size)
+        return self
+
+    def summary(self, top: int = 10, quantiles: Sequence[float] = (0.5, 0.9, 0.99)) -> dict:
+        return {
+            "rows": self.rows,
+            "distinct_ips": {
+                "estimate": self.distinct_ips.count(),
+                "relative_error": self.distinct_ips.relative_error,
+            },
+            "distinct_user_agents": {
+                "estimate": self.distinct_user_agents.count(),
+                "relative_error": self.distinct_user_agents.relative_error,
+            },
+            "heavy_urls": self.heavy_urls.top(top),
+            "heavy_ips": self.heavy_ips.top(top),
+            "response_size_quantiles": [
+                {"q": q, "value": self.response_size.quantile(q), "rank_error": self.response_size.rank_error(q)}
+                for q in quantiles
+            ],
+        }
+
+    def to_dict(self) -> dict:
+        return {
+            "rows": self.rows,
+            "distinct_ips": self.distinct_ips.to_dict(),
+            "distinct_user_agents": self.distinct_user_agents.to_dict(),
+            "heavy_urls": self.heavy_urls.to_dict(),
+            "heavy_ips": self.heavy_ips.to_dict(),
+            "response_size": self.response_size.to_dict(),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "LogSketches":
+        return cls(
+            rows=data["rows"],
+            distinct_ips=HyperLogLog.from_dict(data["distinct_ips"]),
+            distinct_user_agents=HyperLogLog.from_dict(data["distinct_user_agents"]),
+            heavy_urls=SpaceSaving.from_dict(data["heavy_urls"]),
+            heavy_ips=SpaceSaving.from_dict(data["heavy_ips"]),
+            response_size=TDigest.from_dict(data["response_size"]),
+        )
@@ -0,0 +1,46 @@
+import hashlib
+from fastapi import Depends, HTTPException, Request, Response
+from sqlalchemy.orm import Session
+from db.database import get_read_db
+from models.logsEntity import Log
+
+# Log data only changes when rows are appended, which bumps Log.version, so clients
+# may keep responses but must revalidate them with If-None-Match
+CACHE_CONTROL = "private, no-cache"
+
+
+def log_etag(log_id: int, version: int, request: Request) -> str:
+    """Weak ETag for one representation: the log, its ingest version and the exact route and query.
+
+    Weak because BrotliMiddleware may serve the same tag with br, gzip or identity bodies, and a
+    strong validator would have to differ per content-coding.
+    """
+    target = hashlib.blake2b(
+        f"{request.url.path}?{request.url.query}".encode(), digest_size=8
+    ).hexdigest()
+    return f'W/"log-{log_id}-v{version}-{target}"'
+
+
+def etag_matches(etag: str, if_none_match: str) -> bool:
+    # If-None-Match uses weak comparison, so a W/ prefix is ignored
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or any(tag.removeprefix("W/") == etag.removeprefix("W/") for tag in candidates)
+
+
+def conditional_log(log_id: int, request: Request, response: Response, db: Session = Depends(get_read_db)):
+    """Answer 304 before any row query runs when the client already holds the current representation.
+
+    Responses for sampled logs are also flagged with X-Estimated and X-Sample-Rate headers.
+    """
+    found = db.query(Log.version, Log.sample_rate).filter(Log.id == log_id).first()
+    if found is None:
+        return  # Let the route report the missing log
+    version, sample_rate = found
+    etag = log_etag(log_id, version or 0, request)
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+    if sample_rate is not None and sample_rate < 1:
+        headers.update({"X-Estimated": "true", "X-Sample-Rate": str(sample_rate)})
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag_matches(etag, if_none_match):
+        raise HTTPException(status_code=304, headers=headers)
+    response.headers.update(headers)